@@ -1,19 +1,31 @@
 import os
-import requests
+import atexit
 import json
 import logging
-from typing import Optional, List
-import PyPDF2
-from io import BytesIO
+from typing import Callable, Optional, List
 from dotenv import load_dotenv
 import pinecone
+import requests
+import urllib3
 import time
-from flask import Flask, request, abort
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, abort
 from linebot.v3 import WebhookHandler
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi, ReplyMessageRequest, TextMessage
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.exceptions import InvalidSignatureError
+from linebot.v3.exceptions import InvalidSignatureError
 import cohere
+from cache import EmbeddingCache, ResponseCache
+from chunking import Chunker, count_tokens
+from dispatcher import EventDispatcher
+from intents import IntentMatcher
+from llm import stream_completion
+from metrics import REGISTRY, STAGE_SECONDS, maybe_profile, span
+from pdf_text import PdfTextExtractor
+from products import ProductIndex
+from retrieval import BM25Index, pack_context, reciprocal_rank_fusion
+from vector_store import LocalVectorStore, PineconeVectorStore, VectorStore
 
 # Load environment variables
 load_dotenv()
@@ -25,12 +37,78 @@ logger = logging.getLogger(__name__)
 # Configuration
 CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
 CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
+# Override the LINE Messaging API base URL, e.g. to point at the bench/stubs.py stand-in
+LINE_API_HOST = os.getenv('LINE_API_HOST')
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
-PINECONE_ENVIRONMENT = os.getenv('PINECONE_ENVIRONMENT', 'gcp-starter')
 PINECONE_INDEX_NAME = os.getenv('PINECONE_INDEX_NAME', 'hipurino-index1')
 COHERE_API_KEY = os.getenv('COHERE_API_KEY')
 COHERE_EMBEDDING_MODEL = "embed-english-light-v2.0"
+PINECONE_NAMESPACE = "pdf_documents"
+# "pinecone" or "local" (in-process NumPy index under LOCAL_INDEX_DIR, built by ingest.py)
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'pinecone')
+LOCAL_INDEX_DIR = os.getenv('LOCAL_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'vector_index'))
+INDEX_MANIFEST_PATH = os.getenv('INDEX_MANIFEST_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'index_manifest.json'))
+
+# Chunk sizes in (estimated) tokens; chunks stay inside the embedding model's 512-token window
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '480'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '32'))
+
+# Retrieval: chunks fused from BM25 and vector search, packed into the LLM context up to a token budget
+SEARCH_TOP_K = int(os.getenv('SEARCH_TOP_K', '4'))
+CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', '1200'))
+RRF_K = 60
+
+# Embedding cache; set EMBEDDING_CACHE_PATH to an empty string to keep it in memory only
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '2048'))
+EMBEDDING_CACHE_TTL = float(os.getenv('EMBEDDING_CACHE_TTL', '0'))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'embedding_cache.sqlite3'))
+
+# LLM settings and answer cache; RESPONSE_CACHE_SEMANTIC_DISTANCE > 0 also reuses answers for
+# near-duplicate questions (cosine distance) that retrieved the same context
+OPENROUTER_MODEL = os.getenv('OPENROUTER_MODEL', 'deepseek/deepseek-r1:free')
+OPENROUTER_TEMPERATURE = 0.3
+# Comma-separated models tried in order: the next one is also asked when the previous has not
+# streamed an answer token within OPENROUTER_HEDGE_MS, and the first to answer wins
+OPENROUTER_MODELS = [m.strip() for m in os.getenv('OPENROUTER_MODELS', OPENROUTER_MODEL).split(',') if m.strip()]
+OPENROUTER_HEDGE_SECONDS = int(os.getenv('OPENROUTER_HEDGE_MS', '4000')) / 1000
+OPENROUTER_URL = os.getenv('OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
+# Time allowed per message from the webhook arriving (ASYNC_WEBHOOKS queue wait included) to the reply;
+# whatever the LLM has streamed by then is sent, or the best spec/chunk if it has nothing (LINE reply tokens expire)
+REPLY_BUDGET_SECONDS = float(os.getenv('REPLY_BUDGET_SECONDS', '20'))
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '512'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '0'))
+RESPONSE_CACHE_SEMANTIC_DISTANCE = float(os.getenv('RESPONSE_CACHE_SEMANTIC_DISTANCE', '0'))
+
+# Ingestion tuning
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '4'))
+EMBED_BATCH_SIZE = min(int(os.getenv('EMBED_BATCH_SIZE', '96')), 96)  # Cohere accepts at most 96 texts per embed call
+UPSERT_BATCH_SIZE = int(os.getenv('UPSERT_BATCH_SIZE', '100'))
+DELETE_BATCH_SIZE = 1000  # Pinecone deletes at most 1000 ids per request
+INGEST_MAX_RETRIES = int(os.getenv('INGEST_MAX_RETRIES', '5'))
+INGEST_BACKOFF_SECONDS = float(os.getenv('INGEST_BACKOFF_SECONDS', '1.0'))
+# PDFs are read from PDF_DIR when present (falling back to PDF_URLS) and their page texts cached on disk;
+# set PDF_TEXT_CACHE_PATH to an empty string to disable the cache
+PDF_DIR = os.getenv('PDF_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdfs'))
+PDF_TEXT_CACHE_PATH = os.getenv('PDF_TEXT_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pdf_text.sqlite3'))
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+# Index is normally built at deploy time by ingest.py; set to 1 to build it when the web worker boots instead
+INDEX_ON_STARTUP = os.getenv('INDEX_ON_STARTUP', '0') == '1'
+
+# Webhook handling: with ASYNC_WEBHOOKS=1, /callback only verifies and queues events and
+# a pool of WEBHOOK_WORKERS threads sends the replies
+ASYNC_WEBHOOKS = os.getenv('ASYNC_WEBHOOKS', '0') == '1'
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+
+# Opt-in sampling profiler: fraction of messages profiled, hottest frames logged and, with PROFILE_DIR,
+# stacks saved in collapsed (flamegraph) format
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_SECONDS = int(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+
+INTENTS_PATH = os.getenv('INTENTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'intents.json'))
+PRODUCTS_PATH = os.getenv('PRODUCTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'all_products.json'))
 
 # PDF URLs
 PDF_URLS = [
@@ -47,27 +125,78 @@ PDF_URLS = [
     "https://raw.githubusercontent.com/purit/hipurino-datasheets/main/pdfs/961125.pdf",
 ]
 
-if not all([CHANNEL_ACCESS_TOKEN, CHANNEL_SECRET, PINECONE_API_KEY, COHERE_API_KEY]):
+if not all([CHANNEL_ACCESS_TOKEN, CHANNEL_SECRET, COHERE_API_KEY]):
+    raise ValueError("Missing required environment variables")
+if VECTOR_BACKEND not in ("pinecone", "local"):
+    raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+if VECTOR_BACKEND == "pinecone" and not PINECONE_API_KEY:
     raise ValueError("Missing required environment variables")
 
 app = Flask(__name__)
-configuration = Configuration(access_token=CHANNEL_ACCESS_TOKEN)
+configuration = Configuration(access_token=CHANNEL_ACCESS_TOKEN, host=LINE_API_HOST)
 api_client = ApiClient(configuration)
 messaging_api = MessagingApi(api_client)
 handler = WebhookHandler(CHANNEL_SECRET)
 
 # Initialize Pinecone
-pc = pinecone.Pinecone(api_key=PINECONE_API_KEY, environment=PINECONE_ENVIRONMENT)
+pc = pinecone.Pinecone(api_key=PINECONE_API_KEY) if VECTOR_BACKEND == "pinecone" else None
+
+# Network failures worth retrying; pinecone only has its own connection/timeout errors in newer clients
+TRANSIENT_ERRORS = (
+    requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError, cohere.error.CohereConnectionError,
+    urllib3.exceptions.ProtocolError, urllib3.exceptions.MaxRetryError, urllib3.exceptions.TimeoutError,
+) + tuple(getattr(pinecone, name) for name in ("PineconeConnectionError", "PineconeTimeoutError") if hasattr(pinecone, name))
+
+def is_transient(e: Exception) -> bool:
+    """Rate limits, server errors and network errors; anything else (bad input, bugs) fails at once."""
+    # Cohere exposes http_status, Pinecone status (older clients) or status_code
+    for attr in ('http_status', 'status', 'status_code'):
+        status = getattr(e, attr, None)
+        if isinstance(status, int):
+            return status == 429 or status >= 500
+    return isinstance(e, TRANSIENT_ERRORS)
+
+def with_retries(fn, description: str, attempts: int = INGEST_MAX_RETRIES):
+    delay = INGEST_BACKOFF_SECONDS
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts or not is_transient(e):
+                raise
+            logger.warning(f"{description} failed (attempt {attempt}/{attempts}): {e}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+            delay *= 2
+
+def _log_stage(stage: str, started: float, detail: str):
+    logger.info(f"Ingest stage '{stage}': {detail} in {time.perf_counter() - started:.2f}s")
 
 class PDFProcessor:
-    def __init__(self):
-        self.cached_text: Optional[str] = None
+    def __init__(self, populate: bool = True):
         self.co = cohere.Client(COHERE_API_KEY)
-        self.index = self._connect_pinecone(pc)
-        self._populate_index()
+        self.embedding_cache = EmbeddingCache(
+            COHERE_EMBEDDING_MODEL, max_size=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL, path=EMBEDDING_CACHE_PATH
+        )
+        self.chunker = Chunker(CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS)
+        self.pdf_text = PdfTextExtractor(
+            PDF_DIR, PDF_TEXT_CACHE_PATH, workers=PDF_EXTRACT_WORKERS, download_workers=INGEST_WORKERS
+        )
+        self.store = self._connect_store()
+        self.lexical_index = BM25Index([])
+        if populate:
+            self._populate_index()
+        else:
+            self._load_lexical_index(self._load_manifest())
+
+    def _connect_store(self) -> VectorStore:
+        if VECTOR_BACKEND == "local":
+            return LocalVectorStore(LOCAL_INDEX_DIR)
+        index, created = self._connect_pinecone(pc)
+        return PineconeVectorStore(index, PINECONE_INDEX_NAME, PINECONE_NAMESPACE, created=created)
 
     def _connect_pinecone(self, pc_instance):
-        if PINECONE_INDEX_NAME not in pc_instance.list_indexes().names():
+        created = PINECONE_INDEX_NAME not in pc_instance.list_indexes().names()
+        if created:
             pc_instance.create_index(
                 name=PINECONE_INDEX_NAME,
                 dimension=1024,
@@ -78,34 +207,23 @@ class PDFProcessor:
             logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' created.")
         else:
             logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' already exists.")
-        return pc_instance.Index(PINECONE_INDEX_NAME)
-
-    def download_pdf(self, url: str) -> Optional[BytesIO]:
-        try:
-            res = requests.get(url, timeout=10)
-            res.raise_for_status()
-            return BytesIO(res.content)
-        except Exception as e:
-            logger.error(f"Download error [{url}]: {e}")
-            return None
-
-    def extract_text(self, stream: BytesIO) -> str:
-        try:
-            reader = PyPDF2.PdfReader(stream)
-            return "\n".join(filter(None, (page.extract_text() for page in reader.pages)))
-        except Exception as e:
-            logger.error(f"Extract error: {e}")
-            return ""
+        return pc_instance.Index(PINECONE_INDEX_NAME), created
 
     def get_embedding(self, text: str) -> Optional[List[float]]:
+        cached = self.embedding_cache.get(text)
+        if cached is not None:
+            logger.debug(f"Embedding cache hit for text: '{text[:50]}...'")
+            return cached
         try:
-            logger.info(f"Getting embedding for text: '{text[:50]}...'")
+            logger.debug(f"Getting embedding for text: '{text[:50]}...'")
             response = self.co.embed(
-                texts=[text[:512]],
-                model=COHERE_EMBEDDING_MODEL
+                texts=[text],
+                model=COHERE_EMBEDDING_MODEL,
+                truncate="END"
             )
             if response.embeddings and len(response.embeddings) > 0:
-                logger.info("Successfully got embedding.")
+                logger.debug("Successfully got embedding.")
+                self.embedding_cache.set(text, response.embeddings[0])
                 return response.embeddings[0]
             else:
                 logger.error(f"Cohere Embedding response format unexpected: {response}")
@@ -117,50 +235,311 @@ class PDFProcessor:
             logger.error(f"Cohere Embedding error: {type(e)}, {e}")
             return None
 
-    def _populate_index(self):
-        all_text = []
-        for pdf_url in PDF_URLS:
-            try:
-                pdf_stream = self.download_pdf(pdf_url)
-                if not pdf_stream:
-                    continue
-                text = self.extract_text(pdf_stream)
-                if not text:
-                    continue
-                chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
-                for i, chunk in enumerate(chunks):
-                    embedding = self.get_embedding(chunk)
-                    if embedding:
-                        self.index.upsert(
-                            vectors=[{"id": f"{pdf_url.split('/')[-1]}-{i}", "values": embedding, "metadata": {"text": chunk, "source": pdf_url}}],
-                            namespace="pdf_documents"
-                        )
-                logger.info(f"Processed and indexed: {pdf_url}")
-                all_text.append(text)
-            except Exception as e:
-                logger.error(f"Error processing {pdf_url}: {e}")
-        self.cached_text = "\n".join(all_text)
-        logger.info("PDF documents processed and indexed.")
-
-    def search(self, query: str, top_k: int = 1, context_length: int = 1000) -> List[str]:
-        logger.info(f"Searching Pinecone for query: '{query}'")
-        emb = self.get_embedding(query)
+    def _embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        try:
+            response = with_retries(
+                lambda: self.co.embed(texts=texts, model=COHERE_EMBEDDING_MODEL, truncate="END"),
+                f"Cohere embed of {len(texts)} texts"
+            )
+            if response.embeddings and len(response.embeddings) == len(texts):
+                return list(response.embeddings)
+            logger.error(f"Cohere Embedding response format unexpected: {len(response.embeddings or [])} embeddings for {len(texts)} texts")
+        except Exception as e:
+            logger.error(f"Cohere batch embedding error: {type(e)}, {e}")
+        return [None] * len(texts)
+
+    def get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        embeddings = [self.embedding_cache.get(t) for t in texts]
+        missing = [i for i, emb in enumerate(embeddings) if emb is None]
+        batches = [missing[i:i+EMBED_BATCH_SIZE] for i in range(0, len(missing), EMBED_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as pool:
+            results = pool.map(lambda batch: self._embed_batch([texts[i] for i in batch]), batches)
+            for batch, batch_embeddings in zip(batches, results):
+                for i, emb in zip(batch, batch_embeddings):
+                    if emb is not None:
+                        self.embedding_cache.set(texts[i], emb)
+                    embeddings[i] = emb
+        logger.info(f"Embeddings: {len(texts) - len(missing)}/{len(texts)} from cache, cache stats: {self.embedding_cache.stats()}")
+        return embeddings
+
+    def _upsert_batch(self, vectors: List[dict]) -> bool:
+        try:
+            with_retries(
+                lambda: self.store.upsert(vectors),
+                f"Vector store upsert of {len(vectors)} vectors"
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error upserting {len(vectors)} vectors to vector store: {e}")
+            return False
+
+    def upsert_vectors(self, vectors: List[dict]) -> set:
+        """Upserts in bulk and returns the ids that failed to be written."""
+        batches = [vectors[i:i+UPSERT_BATCH_SIZE] for i in range(0, len(vectors), UPSERT_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as pool:
+            results = list(pool.map(self._upsert_batch, batches))
+        return {v["id"] for batch, ok in zip(batches, results) if not ok for v in batch}
+
+    def _empty_manifest(self) -> dict:
+        return {
+            "model": COHERE_EMBEDDING_MODEL,
+            "index": self.store.name,
+            "chunking": self.chunker.signature(),
+            "documents": {},
+        }
+
+    def _load_manifest(self, purge_stale: bool = False) -> dict:
+        """Returns the manifest describing the store, or an empty one when it cannot be trusted.
+
+        With purge_stale (when re-indexing), vectors an untrusted manifest lists are deleted,
+        and the whole store is cleared when there is no manifest to say what is in it.
+        """
+        # A fresh index has none of our vectors, so the manifest cannot be trusted
+        if self.store.created:
+            return self._empty_manifest()
+        try:
+            with open(INDEX_MANIFEST_PATH, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read index manifest {INDEX_MANIFEST_PATH}: {e}")
+            manifest = None
+        if not isinstance(manifest, dict):
+            if purge_stale:
+                self._clear_store()
+            return self._empty_manifest()
+        if (manifest.get("model"), manifest.get("index"), manifest.get("chunking")) != (
+            COHERE_EMBEDDING_MODEL, self.store.name, self.chunker.signature()
+        ):
+            logger.info("Index manifest was built for another model, index or chunking, re-indexing everything.")
+            if purge_stale:
+                self._delete_vectors([
+                    v["id"] for entry in (manifest.get("documents") or {}).values() for v in entry.get("vectors", [])
+                ])
+            return self._empty_manifest()
+        manifest.setdefault("documents", {})
+        return manifest
+
+    def _save_manifest(self, manifest: dict):
+        # Write-then-rename so concurrently booting workers never see a half-written file
+        tmp_path = f"{INDEX_MANIFEST_PATH}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(INDEX_MANIFEST_PATH) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, INDEX_MANIFEST_PATH)
+            logger.info(f"Index manifest saved: {INDEX_MANIFEST_PATH}")
+        except OSError as e:
+            logger.error(f"Could not write index manifest {INDEX_MANIFEST_PATH}: {e}")
+
+    def _load_lexical_index(self, manifest: dict):
+        # Built from the chunk texts in the manifest, so lexical search needs no vector store round trip
+        self.lexical_index = BM25Index.from_manifest(manifest)
+        if len(self.lexical_index):
+            logger.info(f"Lexical index built: {len(self.lexical_index)} chunks")
+        else:
+            logger.warning(f"No chunks in {INDEX_MANIFEST_PATH}, search falls back to vectors only.")
+
+    def _delete_vectors(self, ids: List[str]):
+        if not ids:
+            return
+        try:
+            for i in range(0, len(ids), DELETE_BATCH_SIZE):
+                self.store.delete(ids[i:i+DELETE_BATCH_SIZE])
+            logger.info(f"Deleted {len(ids)} stale vectors from vector store.")
+        except Exception as e:
+            logger.error(f"Error deleting vectors from vector store: {e}")
+
+    def _clear_store(self):
+        # Vectors written by an older version, or listed in a lost manifest, cannot be found by id
+        try:
+            self.store.clear()
+            logger.info(f"No usable index manifest, cleared vector store '{self.store.name}' before re-indexing.")
+        except Exception as e:
+            logger.error(f"Error clearing vector store: {e}")
+
+    def _fetch_documents(self, documents: dict, force: bool) -> List[dict]:
+        def unchanged(url: str, digest: str) -> bool:
+            return not force and (documents.get(url) or {}).get("sha256") == digest
+
+        fetched = []
+        # Unchanged PDFs are hashed but not parsed; the rest come from the page cache or a process pool
+        for doc in self.pdf_text.documents(PDF_URLS, skip=unchanged):
+            if doc["digest"] is None:
+                doc["status"] = "failed"
+            elif doc["pages"] is None:
+                doc["status"] = "unchanged" if unchanged(doc["url"], doc["digest"]) else "failed"
+            else:
+                doc["text"] = "\n".join(filter(None, doc["pages"]))
+                # PDFs without a text layer (scanned datasheets) have nothing to embed
+                doc["status"] = "changed" if doc["text"] else "empty"
+            fetched.append(doc)
+        return fetched
+
+    def _populate_index(self, force: bool = False) -> dict:
+        manifest = self._load_manifest(purge_stale=True)
+        documents = manifest["documents"]
+        changed = False
+
+        started = time.perf_counter()
+        fetched = self._fetch_documents(documents, force)
+        _log_stage("read+extract", started, f"{len(fetched)} PDFs, {self.pdf_text.stats()}")
+
+        chunks = []
+        for doc in fetched:
+            entry = documents.get(doc["url"])
+            if doc["status"] == "changed":
+                filename = doc["url"].split("/")[-1]
+                product_id = os.path.splitext(filename)[0]
+                doc["chunks"] = [
+                    (f"{filename}-{i}", chunk)
+                    for i, chunk in enumerate(self.chunker.chunk_pages(doc["pages"], product_id))
+                ]
+                chunks.extend(doc["chunks"])
+            elif doc["status"] == "empty":
+                doc["chunks"] = []
+            elif entry and doc["status"] == "unchanged":
+                logger.info(f"Unchanged, skipping: {doc['url']}")
+        summary = {
+            "indexed": 0,
+            "unchanged": sum(doc["status"] == "unchanged" for doc in fetched),
+            "failed": sum(doc["status"] == "failed" for doc in fetched),
+            "empty": sum(doc["status"] == "empty" for doc in fetched),
+            "removed": 0,
+        }
+
+        started = time.perf_counter()
+        embeddings = self.get_embeddings([chunk["text"] for _, chunk in chunks])
+        embedded = {chunk_id: emb for (chunk_id, _), emb in zip(chunks, embeddings) if emb}
+        _log_stage("embed", started, f"{len(embedded)}/{len(chunks)} chunks")
+
+        vectors = []
+        for doc in fetched:
+            if doc["status"] not in ("changed", "empty"):
+                continue
+            doc["vectors"] = [
+                {"id": chunk_id, "values": embedded[chunk_id], "metadata": dict(chunk, source=doc["url"])}
+                for chunk_id, chunk in doc["chunks"] if chunk_id in embedded
+            ]
+            vectors.extend(doc["vectors"])
+
+        started = time.perf_counter()
+        failed_ids = self.upsert_vectors(vectors)
+        _log_stage("upsert", started, f"{len(vectors) - len(failed_ids)}/{len(vectors)} vectors")
+
+        for doc in fetched:
+            if doc["status"] not in ("changed", "empty"):
+                continue
+            pdf_url = doc["url"]
+            written = [v for v in doc["vectors"] if v["id"] not in failed_ids]
+            new_ids = {v["id"] for v in written}
+            entry = documents.get(pdf_url)
+            if entry:
+                self._delete_vectors([v["id"] for v in entry["vectors"] if v["id"] not in new_ids])
+            documents[pdf_url] = {
+                # Leave the hash unset when some chunks failed to embed or upsert so the next boot retries them
+                "sha256": doc["digest"] if len(written) == len(doc["chunks"]) else None,
+                "text": doc["text"],
+                "vectors": written,
+            }
+            changed = True
+            if doc["status"] == "empty":
+                logger.warning(f"No extractable text, nothing indexed: {pdf_url}")
+                continue
+            summary["indexed" if documents[pdf_url]["sha256"] else "failed"] += 1
+            logger.info(f"Processed and indexed: {pdf_url}")
+        for removed_url in set(documents) - set(PDF_URLS):
+            self._delete_vectors([v["id"] for v in documents.pop(removed_url)["vectors"]])
+            logger.info(f"Removed from index: {removed_url}")
+            summary["removed"] += 1
+            changed = True
+        # Persist the vectors before the manifest that claims they exist
+        self.store.flush()
+        if changed:
+            self._save_manifest(manifest)
+        self._load_lexical_index(manifest)
+        logger.info(f"PDF documents processed and indexed: {summary}")
+        return summary
+
+    def _vector_search(self, query: str, top_k: int) -> List[dict]:
+        with span("embedding"):
+            emb = self.get_embedding(query)
         if not emb:
-            logger.warning("Could not get embedding for query, returning empty search results.")
+            logger.warning("Could not get embedding for query, using lexical results only.")
             return []
         try:
-            results = self.index.query(vector=emb, top_k=1, include_metadata=True, namespace="pdf_documents")
-            matches = results.get('matches', [])
-            texts = [m['metadata']['text'][:context_length] for m in matches if 'metadata' in m and 'text' in m['metadata']]
-            logger.info(f"Search results from Pinecone: {texts}")
-            return texts
+            with span("vector_query"):
+                return self.store.query(emb, top_k=top_k)
         except Exception as e:
-            logger.error(f"Error querying Pinecone: {e}")
+            logger.error(f"Error querying vector store: {e}")
             return []
 
-pdf_processor = PDFProcessor()
+    def search(self, query: str, top_k: int = SEARCH_TOP_K) -> List[dict]:
+        """Returns up to top_k chunk matches, best first, fusing BM25 and vector rankings."""
+        logger.debug(f"Searching for query: '{query}'")
+        # Rank deeper than top_k in each retriever so fusion can promote chunks both agree on
+        candidates = top_k * 3
+        with span("lexical_query"):
+            lexical = self.lexical_index.query(query, candidates)
+        if lexical and product_index.find_by_part_no(query):
+            # The English embedding model cannot tell part numbers apart; BM25 matches them exactly
+            rankings = [lexical]
+        else:
+            rankings = [lexical, self._vector_search(query, candidates)]
+        matches = reciprocal_rank_fusion(rankings, k=RRF_K)[:top_k]
+        logger.debug(f"Search results ({'+'.join(str(len(r)) for r in rankings)} candidates): {[m['id'] for m in matches]}")
+        return matches
 
-def query_openrouter(question: str, context: str) -> str:
+_pdf_processor: Optional[PDFProcessor] = None
+_pdf_processor_lock = threading.Lock()
+
+def get_pdf_processor() -> PDFProcessor:
+    # Attach lazily so importing app.py (and booting a gunicorn worker) does no network I/O
+    global _pdf_processor
+    if _pdf_processor is None:
+        with _pdf_processor_lock:
+            if _pdf_processor is None:
+                _pdf_processor = PDFProcessor(populate=INDEX_ON_STARTUP)
+    return _pdf_processor
+
+if INDEX_ON_STARTUP:
+    get_pdf_processor()
+
+intent_matcher = IntentMatcher.load(INTENTS_PATH)
+INTENT_REPLIES = {
+    "positive": "ขอบคุณมากครับ/ค่ะ ยินดีที่ให้บริการเสมอครับ/ค่ะ 😊",
+    "negative": "ขออภัยเป็นอย่างสูงสำหรับประสบการณ์ที่ไม่ดีครับ/ค่ะ 😥 ทางเราจะปรับปรุงให้ดีขึ้นครับ/ค่ะ",
+    "rude": "ต้องขออภัยในความไม่สุภาพนะครับ/คะ 🙏 เรามาพูดคุยกันด้วยภาษาที่สุภาพกันดีกว่าครับ/ค่ะ",
+    "greeting": "สวัสดีครับ/ค่ะ มีอะไรให้ผม/ดิฉันช่วยค้นหาจากข้อมูลในเอกสารได้บ้างครับ? 🤔",
+}
+
+# Structured specs answer direct part-number questions without embedding, vector search or LLM calls
+product_index = ProductIndex.load(PRODUCTS_PATH)
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SEMANTIC_DISTANCE)
+
+MESSAGES = REGISTRY.counter("messages_total", "Text messages handled, by how they were answered.")
+LLM_REQUESTS = REGISTRY.counter("llm_requests_total", "query_openrouter calls by outcome and answering model.")
+CONTEXT_TOKENS = REGISTRY.gauge("rag_context_tokens", "Estimated tokens of LLM context packed for the last RAG message.")
+CONTEXT_CHUNKS = REGISTRY.gauge("rag_context_chunks", "Chunks retrieved for the last RAG message.")
+ANSWER_TOKENS = REGISTRY.gauge("llm_answer_tokens", "Estimated tokens of the last LLM answer.")
+
+def _index_version() -> Optional[int]:
+    try:
+        return os.stat(INDEX_MANIFEST_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+def query_openrouter(question: str, context: str, embed_question: Optional[Callable[[], Optional[List[float]]]] = None,
+                     deadline: Optional[float] = None, fallback: Optional[str] = None) -> str:
+    models_key = ",".join(OPENROUTER_MODELS)
+    response_cache.sync_version(_index_version())
+    cached = response_cache.get(question, context, models_key, OPENROUTER_TEMPERATURE, embed_question)
+    if cached is not None:
+        logger.debug(f"Response cache hit for question: '{question[:50]}...'")
+        LLM_REQUESTS.inc(outcome="cached", model="")
+        return cached
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
@@ -168,35 +547,43 @@ def query_openrouter(question: str, context: str) -> str:
         "X-Title": "PDF Chatbot"
     }
     data = {
-        "model": "deepseek/deepseek-r1:free",
         "messages": [
             {"role": "system", "content": "คุณเป็นผู้ช่วยที่ตอบคำถามจากข้อมูลที่ให้มาเท่านั้น หากมีข้อมูลสเปคของสินค้าในข้อมูลอ้างอิง ให้ตอบสเปคเหล่านั้น หากไม่มีหรือไม่แน่ใจ ให้แจ้งว่าไม่มีข้อมูลสเปค"},
             {"role": "user", "content": f"ข้อมูลอ้างอิง:\n{context}\n\nคำถาม: {question}\n\nคำตอบ:"}
         ],
-        "temperature": 0.3
+        "temperature": OPENROUTER_TEMPERATURE
     }
-    try:
-        logger.info(f"Querying OpenRouter with question: '{question[:50]}...' and context length: {len(context)}")
-        res = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=data, timeout=20)
-        res.raise_for_status()
-        response_data = res.json()
-        logger.info(f"OpenRouter Response: {response_data}")
-        if response_data.get('choices'):
-            return response_data['choices'][0]['message']['content'].strip()
-        else:
-            logger.error(f"Invalid response format from OpenRouter: {response_data}")
-            return "ขออภัย เกิดข้อผิดพลาดในการประมวลผลจาก OpenRouter"
-    except requests.exceptions.RequestException as e:
-        logger.error(f"OpenRouter request failed: {e}")
-        return "ขออภัย เกิดปัญหาการเชื่อมต่อกับ OpenRouter"
-    except Exception as e:
-        logger.error(f"OpenRouter error: {e}")
-        return "ขออภัย เกิดข้อผิดพลาดในการประมวลผลจาก OpenRouter"
+    if deadline is None:
+        deadline = time.monotonic() + REPLY_BUDGET_SECONDS
+    logger.info(f"Querying OpenRouter with question: '{question[:50]}...' and context length: {len(context)}")
+    started = time.monotonic()
+    result = stream_completion(OPENROUTER_URL, headers, data, OPENROUTER_MODELS, deadline, OPENROUTER_HEDGE_SECONDS)
+    if result.first_token is not None:
+        STAGE_SECONDS.observe(result.first_token, stage="llm_first_token")
+    if result.text:
+        ANSWER_TOKENS.set(count_tokens(result.text))
+    if result.complete and result.text:
+        LLM_REQUESTS.inc(outcome="complete", model=result.model)
+        logger.info(f"OpenRouter answer from {result.model}: {len(result.text)} chars in {time.monotonic() - started:.2f}s")
+        # The semantic lookup above already embedded the question, so this is an embedding cache hit
+        query_embedding = embed_question() if embed_question else None
+        response_cache.set(question, context, models_key, OPENROUTER_TEMPERATURE, result.text, query_embedding)
+        return result.text
+    logger.warning(f"OpenRouter answer incomplete after {time.monotonic() - started:.2f}s ({result.error or 'latency budget used up'}), {len(result.text)} chars received")
+    # Partial answers and fallbacks are not cached, so the question is asked again next time
+    LLM_REQUESTS.inc(outcome="partial" if result.text else "fallback" if fallback else "failed", model=result.model or "")
+    if result.text:
+        return f"{result.text} …\n\n(คำตอบยังไม่ครบ เนื่องจากระบบใช้เวลานานเกินไป)"
+    if fallback:
+        return fallback
+    return "ขออภัย เกิดปัญหาการเชื่อมต่อกับ OpenRouter"
 
 @app.route("/callback", methods=['POST'])
 def callback():
     signature = request.headers.get('X-Line-Signature', '')
     body = request.get_data(as_text=True)
+    if ASYNC_WEBHOOKS:
+        return enqueue_callback(body, signature)
     try:
         handler.handle(body, signature)
     except InvalidSignatureError:
@@ -207,72 +594,127 @@ def callback():
         abort(500)
     return 'OK'
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+def _cache_samples():
+    caches = [("response", response_cache.stats())]
+    if _pdf_processor is not None:
+        caches.append(("embedding", _pdf_processor.embedding_cache.stats()))
+    for name, stats in caches:
+        yield "cache_requests_total", {"cache": name, "result": "miss"}, stats["misses"]
+        yield "cache_requests_total", {"cache": name, "result": "hit"}, stats["hits"]
+        for extra in ("disk_hits", "semantic_hits"):
+            if extra in stats:
+                yield "cache_requests_total", {"cache": name, "result": extra[:-1]}, stats[extra]
+
+def _cache_size_samples():
+    yield "cache_entries", {"cache": "response"}, response_cache.stats()["size"]
+    if _pdf_processor is not None:
+        yield "cache_entries", {"cache": "embedding"}, _pdf_processor.embedding_cache.stats()["size"]
+
+def _dispatcher_samples():
+    stats = event_dispatcher.stats()
+    yield "webhook_events_dropped_total", {"reason": "duplicate"}, stats["duplicates"]
+    yield "webhook_events_dropped_total", {"reason": "queue_full"}, stats["rejected"]
+
+REGISTRY.collector("cache_requests_total", "counter", "Cache lookups by result.", _cache_samples)
+REGISTRY.collector("cache_entries", "gauge", "Entries held in each in-memory cache.", _cache_size_samples)
+REGISTRY.collector("webhook_events_dropped_total", "counter", "Webhook events not queued.", _dispatcher_samples)
+REGISTRY.collector("webhook_queue_depth", "gauge", "Webhook events waiting for a worker.",
+                   lambda: [("webhook_queue_depth", {}, event_dispatcher.stats()["queued"])])
+
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
+    # Only one parameter: WebhookHandler passes the destination as a second argument
+    reply_to_message(event, time.monotonic())
+
+def reply_to_message(event, received_at: float):
+    with maybe_profile("handle_message", PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_SECONDS, PROFILE_DIR or None), span("handle_message"):
+        _handle_message(event, received_at)
+
+def _handle_message(event, received_at: float):
+    # Counted from when the webhook arrived, so time queued for a worker uses up the budget too
+    deadline = received_at + REPLY_BUDGET_SECONDS
     try:
         user_msg = event.message.text
         user_id = event.source.user_id
         logger.info(f"Message from {user_id}: {user_msg}")
 
-        positive = [
-            "ขอบคุณ", "ขอบใจ", "ขอบคุณครับ", "ขอบคุณค่ะ", "เก่งมาก", "เก่งจัง", "ทำได้ดีมาก", "ดีมาก",
-            "ดีจัง", "เยี่ยมเลย", "สุดยอด", "เจ๋ง", "น่ารัก", "สวย", "หล่อ", "เท่", "ฉลาด",
-            "เข้าใจง่าย", "มีประโยชน์มาก", "ช่วยได้เยอะเลย", "ซึ้งใจ", "ประทับใจ", "ถูกใจ",
-            "ให้กำลังใจ", "ดีที่สุด", "เลิศ", "ยอดเยี่ยม", "ดีงาม", "น่าชื่นชม", "เก่งจริงๆ",
-            "ขอบคุณสำหรับความช่วยเหลือ", "ขอบคุณที่ช่วย", "ขอบคุณนะ", "ขอบคุณมากๆ",
-        ]
-        negative = [
-            "แย่มาก", "ไม่ดีเลย", "ผิดหวัง", "ห่วย", "แย่จัง", "ไม่โอเค", "ห่วยแตก", "ไม่ได้เรื่อง",
-            "ไม่ชอบเลย", "น่าเบื่อ", "เซ็ง", "หงุดหงิด", "โมโห", "โกรธ", "ไม่พอใจ", "แย่ที่สุด",
-            "ห่วยสุดๆ", "รับไม่ได้", "ไม่ไหวแล้ว", "น่ารำคาญ", "ไร้ประโยชน์", "ไม่ได้ช่วยอะไรเลย",
-            "น่าผิดหวังมาก", "แย่กว่าที่คิด", "ทำได้ไม่ดี", "ไม่ถูกใจเลย",
-        ]
-        rude = [
-            "ไอ้", "อี", "เหี้ย", "สัส", "แม่ง", "ชาติ", "ไอ้เวร", "อีเวร", "ไอ้บ้า", "อีบ้า",
-            "ไอ้โง่", "อีโง่", "ไอ้ทึ่ม", "อีทึ่ม", "ไอ้ห่า", "อีห่า", "ไอ้สัตว์", "อีสัตว์",
-            "ไอ้ระยำ", "อีระยำ", "ไอ้เลว", "อีเลว", "ไอ้หน้าโง่", "อีหน้าโง่", "ไอ้หน้าด้าน", "อีหน้าด้าน",
-            "ไอ้สารเลว", "อีสารเลว", "ไอ้เปรต", "อีเปรต", "ไปตายซะ", "เงียบไปเลย", "น่ารังเกียจ",
-            "ปากเสีย", "ประสาท", "บ้า", "โง่", "ทุเรศ", "ต่ำ", "เลว", "ชั่ว",
-        ]
-        greetings = [
-            "หวัดดี", "สวัสดี", "Hi", "Hello", "ไง", "ดี", "โย่ว", "เฮ้", "สวัสครับ", "สวัสค่ะ",
-            "ดีครับ", "ดีค่ะ", "เป็นไงบ้าง", "สบายดีไหม", "ว่าไง", "ทักทาย",
-        ]
-
-        responded = False
-
-        if any(w.lower() in user_msg.lower() for w in positive):
-            reply = "ขอบคุณมากครับ/ค่ะ ยินดีที่ให้บริการเสมอครับ/ค่ะ 😊"
-            responded = True
-        elif any(w.lower() in user_msg.lower() for w in negative):
-            reply = "ขออภัยเป็นอย่างสูงสำหรับประสบการณ์ที่ไม่ดีครับ/ค่ะ 😥 ทางเราจะปรับปรุงให้ดีขึ้นครับ/ค่ะ"
-            responded = True
-        elif any(w.lower() in user_msg.lower() for w in rude):
-            reply = "ต้องขออภัยในความไม่สุภาพนะครับ/คะ 🙏 เรามาพูดคุยกันด้วยภาษาที่สุภาพกันดีกว่าครับ/ค่ะ"
-            responded = True
-        elif user_msg.lower() in map(str.lower, greetings):
-            reply = "สวัสดีครับ/ค่ะ มีอะไรให้ผม/ดิฉันช่วยค้นหาจากข้อมูลในเอกสารได้บ้างครับ? 🤔"
-            responded = True
+        with span("intent"):
+            intent = intent_matcher.classify(user_msg)
+        responded = intent is not None
+        if responded:
+            reply = INTENT_REPLIES[intent]
+            MESSAGES.inc(route="intent")
 
         if not responded:
-            context = "\n\n".join(pdf_processor.search(user_msg))
-            logger.info(f"Context length before sending to OpenRouter: {len(context)}")
-            max_context_length = 750
-            if len(context) > max_context_length:
-                context = context[:max_context_length]
-                logger.warning(f"Context length exceeded limit, truncated to: {len(context)}")
-            logger.info(f"Context from Pinecone for query '{user_msg}':\n{context[:500]}...")
-            reply = query_openrouter(user_msg, context) if context else "ไม่พบข้อมูลที่เกี่ยวข้องกับคำถามของคุณ 😓"
+            with span("product_index"):
+                spec_answer = product_index.answer(user_msg)
+            if spec_answer:
+                logger.info(f"Answered from product index: '{user_msg}'")
+                reply = spec_answer
+                responded = True
+                MESSAGES.inc(route="product_index")
 
-        messaging_api.reply_message_with_http_info(
-            ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply)])
-        )
+        if not responded:
+            with span("search"):
+                matches = get_pdf_processor().search(user_msg)
+            context = pack_context(matches, CONTEXT_MAX_TOKENS)
+            CONTEXT_CHUNKS.set(len(matches))
+            CONTEXT_TOKENS.set(count_tokens(context))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Context for query '{user_msg}' ({len(context)} chars):\n{context[:500]}...")
+            # Sent instead when the LLM has nothing within the latency budget
+            fallback = product_index.overview(user_msg)
+            if not fallback and matches:
+                fallback = "ข้อมูลที่เกี่ยวข้องจากเอกสาร:\n" + pack_context(matches[:1], CONTEXT_MAX_TOKENS)
+            if context:
+                with span("llm"):
+                    # Embedded only if the exact response cache key misses
+                    embed_question = (lambda: get_pdf_processor().get_embedding(user_msg)) if RESPONSE_CACHE_SEMANTIC_DISTANCE else None
+                    reply = query_openrouter(user_msg, context, embed_question, deadline, fallback)
+            else:
+                reply = "ไม่พบข้อมูลที่เกี่ยวข้องกับคำถามของคุณ 😓"
+            MESSAGES.inc(route="rag" if context else "no_context")
+
+        with span("line_reply"):
+            messaging_api.reply_message_with_http_info(
+                ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply)])
+            )
     except Exception as e:
         logger.error(f"Handle error: {e}")
+        MESSAGES.inc(route="error")
         messaging_api.reply_message_with_http_info(
             ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text="ขออภัย เกิดข้อผิดพลาดในการประมวลผล 🤖")]
             )
         )
 
+def dispatch_event(event, received_at: float):
+    STAGE_SECONDS.observe(time.monotonic() - received_at, stage="webhook_queue")
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        reply_to_message(event, received_at)
+
+event_dispatcher = EventDispatcher(dispatch_event, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+atexit.register(event_dispatcher.drain)
+
+def enqueue_callback(body: str, signature: str):
+    received_at = time.monotonic()
+    try:
+        events = handler.parser.parse(body, signature)
+    except InvalidSignatureError:
+        logger.warning("Invalid signature detected")
+        abort(400)
+    except Exception as e:
+        logger.error(f"Callback error: {e}")
+        abort(500)
+    for event in events:
+        if not event_dispatcher.submit(event, received_at):
+            # Events not yet queued are not marked as seen, so LINE's redelivery will pick them up
+            logger.warning(f"Webhook queue full, asking LINE to retry: {event_dispatcher.stats()}")
+            abort(503)
+    return 'OK'
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000)
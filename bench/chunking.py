@@ -0,0 +1,172 @@
+"""Offline comparison of the fixed 1000-character slicing with the structure-aware chunker.
+
+Usage:
+    python bench/chunking.py [--max-tokens 480] [--overlap-tokens 32] [--top-k 3] [--cohere]
+
+For each chunking strategy over the PDFs in pdfs/ it reports the number of
+chunks to embed, how much of the text is actually embedded (the old path
+embedded only the first 512 characters of each chunk), how many spec values
+from data/all_products.json end up whole inside a single embedded chunk, and
+the retrieval hit rate for one "<spec> <product name>" question per spec value.
+
+Retrieval uses TF-IDF cosine similarity so it runs without network access;
+--cohere uses the real embedding model instead (needs COHERE_API_KEY).
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+
+import numpy as np
+import PyPDF2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chunking import Chunker  # noqa: E402
+
+LEGACY_CHUNK_CHARS = 1000
+LEGACY_EMBED_CHARS = 512
+WORD = re.compile(r"[a-z]+|\d+(?:\.\d+)?|[\u0e00-\u0e7f]+")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.replace("\xa0", " ").split()).casefold()
+
+
+def load_pages():
+    documents = {}
+    for path in sorted(glob.glob(os.path.join(ROOT, "pdfs", "*.pdf"))):
+        product_id = os.path.splitext(os.path.basename(path))[0]
+        documents[product_id] = [page.extract_text() or "" for page in PyPDF2.PdfReader(path).pages]
+    return documents
+
+
+def legacy_chunks(documents):
+    chunks = []
+    for product_id, pages in documents.items():
+        text = "\n".join(filter(None, pages))
+        for start in range(0, len(text), LEGACY_CHUNK_CHARS):
+            chunk = text[start:start + LEGACY_CHUNK_CHARS]
+            chunks.append({"product_id": product_id, "text": chunk, "embedded": chunk[:LEGACY_EMBED_CHARS]})
+    return chunks
+
+
+def structured_chunks(documents, chunker: Chunker):
+    chunks = []
+    for product_id, pages in documents.items():
+        for chunk in chunker.chunk_pages(pages, product_id):
+            chunks.append({"product_id": product_id, "text": chunk["text"], "embedded": chunk["text"]})
+    return chunks
+
+
+def build_questions(documents):
+    with open(os.path.join(ROOT, "data", "all_products.json"), encoding="utf-8") as f:
+        products = json.load(f)["products"]
+    questions = []
+    for product in products:
+        full_text = _normalize("\n".join(documents.get(product["product_id"], [])))
+        for key, value in product.get("specifications", {}).items():
+            if not isinstance(value, str):
+                continue
+            core = _normalize(value.split("(")[0])
+            # Only values that appear verbatim in the PDF text can be checked against chunks
+            if len(core) >= 2 and core in full_text:
+                question = f"{key.replace('_', ' ')} {product['name']}"
+                questions.append({"product_id": product["product_id"], "question": question, "value": core})
+    return questions
+
+
+class TfidfRetriever:
+    def __init__(self, texts):
+        docs = [Counter(WORD.findall(_normalize(t))) for t in texts]
+        df = Counter(word for doc in docs for word in doc)
+        self.vocab = {word: i for i, word in enumerate(df)}
+        self.idf = np.array([math.log((1 + len(docs)) / (1 + df[w])) + 1 for w in self.vocab], dtype=np.float32)
+        self.matrix = np.stack([self._vector(doc) for doc in docs])
+
+    def _vector(self, counts):
+        vec = np.zeros(len(self.vocab), dtype=np.float32)
+        for word, count in counts.items():
+            if word in self.vocab:
+                vec[self.vocab[word]] = (1 + math.log(count)) * self.idf[self.vocab[word]]
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def rank(self, query: str):
+        return np.argsort(-(self.matrix @ self._vector(Counter(WORD.findall(_normalize(query))))))
+
+
+class CohereRetriever:
+    def __init__(self, texts):
+        import cohere
+        self.co = cohere.Client(os.environ["COHERE_API_KEY"])
+        self.matrix = self._embed(texts)
+
+    def _embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), 96):
+            response = self.co.embed(texts=texts[start:start + 96], model="embed-english-light-v2.0", truncate="END")
+            vectors.extend(response.embeddings)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    def rank(self, query: str):
+        return np.argsort(-(self.matrix @ self._embed([query])[0]))
+
+
+def evaluate(name, chunks, questions, retriever_cls, top_k):
+    embedded_chars = sum(len(c["embedded"]) for c in chunks)
+    total_chars = sum(len(c["text"]) for c in chunks)
+    whole_values = sum(
+        any(c["product_id"] == q["product_id"] and q["value"] in _normalize(c["embedded"]) for c in chunks)
+        for q in questions
+    )
+    retriever = retriever_cls([c["embedded"] for c in chunks])
+    hits_1 = hits_k = 0
+    for q in questions:
+        ranked = retriever.rank(q["question"])[:top_k]
+        found = [
+            chunks[i]["product_id"] == q["product_id"] and q["value"] in _normalize(chunks[i]["embedded"])
+            for i in ranked
+        ]
+        hits_1 += found[0]
+        hits_k += any(found)
+    return {
+        "strategy": name,
+        "chunks": len(chunks),
+        "avg_chunk_chars": round(total_chars / len(chunks)),
+        "embedded_fraction": round(embedded_chars / total_chars, 3),
+        "values_in_one_chunk": round(whole_values / len(questions), 3),
+        "hit@1": round(hits_1 / len(questions), 3),
+        f"hit@{top_k}": round(hits_k / len(questions), 3),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-tokens", type=int, default=480)
+    parser.add_argument("--overlap-tokens", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--cohere", action="store_true", help="rank with Cohere embeddings instead of TF-IDF")
+    args = parser.parse_args(argv)
+
+    documents = load_pages()
+    questions = build_questions(documents)
+    retriever_cls = CohereRetriever if args.cohere else TfidfRetriever
+    chunker = Chunker(args.max_tokens, args.overlap_tokens)
+    print(f"{len(documents)} PDFs, {len(questions)} spec questions, retriever: {retriever_cls.__name__}")
+    for name, chunks in (
+        ("fixed-1000", legacy_chunks(documents)),
+        (chunker.signature(), structured_chunks(documents, chunker)),
+    ):
+        print(json.dumps(evaluate(name, chunks, questions, retriever_cls, args.top_k)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
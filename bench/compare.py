@@ -0,0 +1,71 @@
+"""Compares two result files from bench/loadtest.py or bench/micro.py.
+
+Usage:
+    python bench/compare.py BASELINE.json CANDIDATE.json [--threshold 10]
+
+Prints every latency (mean, p50, p95, p99) and throughput (rps) figure present
+in both files with its change, and exits with status 1 when any of them got
+worse by more than --threshold percent, so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Tuple
+
+LOWER_IS_BETTER = ("mean", "p50", "p95", "p99")
+HIGHER_IS_BETTER = ("rps",)
+
+
+def figures(result: dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in result.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict) and key != "run":
+            yield from figures(value, path)
+        elif key in LOWER_IS_BETTER + HIGHER_IS_BETTER and isinstance(value, (int, float)):
+            yield path, float(value)
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> Tuple[list, list]:
+    """Returns (rows, regressions); each row is (figure, baseline, candidate, change in percent)."""
+    before: Dict[str, float] = dict(figures(baseline))
+    rows, regressions = [], []
+    for path, value in figures(candidate):
+        if path not in before or not before[path]:
+            continue
+        change = (value - before[path]) / before[path] * 100
+        rows.append((path, before[path], value, change))
+        worse = -change if path.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        if worse > threshold:
+            regressions.append(path)
+    return rows, regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    if baseline["run"]["benchmark"] != candidate["run"]["benchmark"]:
+        raise SystemExit(f"Cannot compare a {baseline['run']['benchmark']} run with a {candidate['run']['benchmark']} run")
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print(f"{baseline['run'].get('commit')} -> {candidate['run'].get('commit')}")
+    for path, before, after, change in rows:
+        mark = "  REGRESSION" if path in regressions else ""
+        unit = "" if path.endswith("rps") else " ms"
+        scale = 1 if path.endswith("rps") else 1000
+        print(f"{path:<40}{before * scale:>12.1f}{after * scale:>12.1f}{unit:<3} {change:+7.1f}%{mark}")
+    if regressions:
+        print(f"{len(regressions)} figures worse by more than {args.threshold:g}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Local stand-in for the OpenRouter chat completions API, streaming or not.
+
+Usage:
+    python bench/fake_openrouter.py [--port 8099] [--first-token 0.5] [--token-delay 0.05]
+                                    [--tokens 40] [--error-rate 0] [--model-delay MODEL=SECONDS ...]
+
+Point the app at it with OPENROUTER_URL=http://127.0.0.1:8099/api/v1/chat/completions.
+--model-delay overrides the first-token delay for one model, e.g. to make the
+primary model slow and watch the hedged request to the next one win. Before
+the first answer token the server streams reasoning deltas and keep-alive
+comments, as OpenRouter does for reasoning models.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def send_json(handler: BaseHTTPRequestHandler, status: int, body: dict):
+    data = json.dumps(body).encode("utf-8")
+    handler.send_response(status)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+
+def _send_event(handler: BaseHTTPRequestHandler, body: dict):
+    handler.wfile.write(f"data: {json.dumps(body, ensure_ascii=False)}\n\n".encode("utf-8"))
+    handler.wfile.flush()
+
+
+def write_completion(handler: BaseHTTPRequestHandler, request: dict, first_token: float, token_delay: float, tokens: int):
+    """Answers one chat completion request, as an SSE stream when it asks for "stream": true."""
+    model = request.get("model", "")
+    # Thai words, so the stream carries raw multi-byte UTF-8 as real answers do
+    words = [f"{model}:คำ{i}" for i in range(tokens)]
+    if not request.get("stream"):
+        time.sleep(first_token + token_delay * tokens)
+        send_json(handler, 200, {"model": model, "choices": [{"message": {"role": "assistant", "content": " ".join(words)}}]})
+        return
+    handler.send_response(200)
+    handler.send_header("Content-Type", "text/event-stream")
+    handler.send_header("Cache-Control", "no-cache")
+    handler.send_header("Connection", "close")
+    handler.end_headers()
+    try:
+        started = time.monotonic()
+        while time.monotonic() - started < first_token:
+            handler.wfile.write(b": OPENROUTER PROCESSING\n\n")
+            _send_event(handler, {"choices": [{"delta": {"reasoning": "thinking "}}]})
+            time.sleep(min(0.1, first_token))
+        for word in words:
+            _send_event(handler, {"model": model, "choices": [{"delta": {"content": word + " "}}]})
+            time.sleep(token_delay)
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        # The client cancelled (hedged request lost, or deadline reached)
+        pass
+    handler.close_connection = True
+
+
+def make_handler(args):
+    model_delays = dict(item.split("=", 1) for item in args.model_delay)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *log_args):
+            if args.verbose:
+                super().log_message(format, *log_args)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if random.random() < args.error_rate:
+                send_json(self, 502, {"error": {"code": 502, "message": "fake upstream error"}})
+                return
+            first_token = float(model_delays.get(request.get("model", ""), args.first_token))
+            write_completion(self, request, first_token, args.token_delay, args.tokens)
+
+    return Handler
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--first-token", type=float, default=0.5, help="seconds before the first answer token")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="seconds between answer tokens")
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 502")
+    parser.add_argument("--model-delay", action="append", default=[], metavar="MODEL=SECONDS")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args))
+    server.daemon_threads = True
+    print(f"Fake OpenRouter on http://127.0.0.1:{args.port}/api/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Accuracy and speed of the intent matcher against the old per-message list scans.
+
+Usage:
+    python bench/intents.py [--repeat 2000]
+
+Scores both classifiers on bench/intents_labelled.json and times them over the
+same messages. The legacy classifier reproduces the keyword checks that used to
+live in handle_message, using the keyword lists from data/intents.json.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from intents import IntentMatcher  # noqa: E402
+
+INTENTS_PATH = os.path.join(ROOT, "data", "intents.json")
+LABELLED_PATH = os.path.join(ROOT, "bench", "intents_labelled.json")
+
+
+def legacy_classifier(path: str):
+    with open(path, encoding="utf-8") as f:
+        intents = json.load(f)["intents"]
+    words = {name: spec["keywords"] + spec.get("standalone", []) for name, spec in intents.items()}
+
+    def classify(user_msg: str):
+        # Same checks, in the same order, as the original handle_message
+        if any(w.lower() in user_msg.lower() for w in words["positive"]):
+            return "positive"
+        if any(w.lower() in user_msg.lower() for w in words["negative"]):
+            return "negative"
+        if any(w.lower() in user_msg.lower() for w in words["rude"]):
+            return "rude"
+        if user_msg.lower() in map(str.lower, words["greeting"]):
+            return "greeting"
+        return None
+
+    return classify
+
+
+def evaluate(classify, rows):
+    misses = [(row["text"], row["intent"], classify(row["text"])) for row in rows]
+    misses = [m for m in misses if m[1] != m[2]]
+    return 1 - len(misses) / len(rows), misses
+
+
+def time_per_message(classify, texts, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            classify(text)
+    return (time.perf_counter() - started) / (repeat * len(texts)) * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="passes over the labelled set when timing")
+    args = parser.parse_args(argv)
+
+    with open(LABELLED_PATH, encoding="utf-8") as f:
+        rows = json.load(f)
+    texts = [row["text"] for row in rows]
+    classifiers = {
+        "legacy": legacy_classifier(INTENTS_PATH),
+        "matcher": IntentMatcher.load(INTENTS_PATH).classify,
+    }
+    for name, classify in classifiers.items():
+        accuracy, misses = evaluate(classify, rows)
+        micros = time_per_message(classify, texts, args.repeat)
+        print(f"{name:8s} accuracy={accuracy:.1%} ({len(rows) - len(misses)}/{len(rows)})  {micros:.1f} us/message")
+        for text, expected, got in misses:
+            print(f"    {text!r}: expected {expected}, got {got}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""Load test of the webhook under gunicorn, with every external service stubbed.
+
+Usage:
+    python bench/loadtest.py [--requests 200] [--concurrency 8] [--workers 1] [--threads 16] [--async]
+                             [--mix greeting=0.2,part=0.4,free=0.4] [--backend pinecone|local]
+                             [--latency SERVICE=SECONDS ...] [--error-rate SERVICE=RATE ...]
+                             [--first-token 0.8] [--token-delay 0.02] [--tokens 60] [--out FILE]
+
+Starts bench/stubs.py in process, builds the index against it with ingest.py
+(manifest, local index and embedding cache go to a temporary directory), then
+runs `gunicorn app:app` pointed at the stubs and posts signed payloads from
+bench/payloads.py to /callback from --concurrency client threads. Reported:
+    http    /callback response time and throughput, overall and per category
+    reply   time from posting the webhook to the LINE reply reaching the stub
+            (with --async the HTTP response only acknowledges the event)
+    stages  per-stage quantiles from the app's /metrics histograms, estimated
+            within bucket bounds as Prometheus' histogram_quantile() does
+/metrics is per process, so stage figures are exact only with --workers 1;
+with more workers each scrape sees one of them. Results are written as JSON
+(see bench/compare.py).
+"""
+import argparse
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+import payloads  # noqa: E402
+import stubs  # noqa: E402
+from report import print_table, run_info, summarize, write_result  # noqa: E402
+
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})? (\S+)$')
+LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+Samples = Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]
+
+
+def parse_metrics(text: str) -> Samples:
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE_PATTERN.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[(name, tuple(sorted(LABEL_PATTERN.findall(labels or ""))))] = float(value)
+    return samples
+
+
+def _delta(after: Samples, before: Samples, name: str) -> Dict[Tuple[Tuple[str, str], ...], float]:
+    return {labels: value - before.get((sample, labels), 0.0) for (sample, labels), value in after.items() if sample == name}
+
+
+def histogram_quantile(q: float, buckets: List[Tuple[float, float]]) -> Optional[float]:
+    """q (0-1) from cumulative (upper bound, count) pairs, interpolating linearly inside the bucket."""
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower, below = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                # Past the largest finite bucket: all we know is the lower bound
+                return lower
+            return lower + (bound - lower) * ((rank - below) / (count - below) if count > below else 0.0)
+        lower, below = bound, count
+    return lower
+
+
+def stage_stats(after: Samples, before: Samples, elapsed: float) -> Dict[str, dict]:
+    buckets: Dict[str, List[Tuple[float, float]]] = {}
+    for labels, count in _delta(after, before, "stage_duration_seconds_bucket").items():
+        labels = dict(labels)
+        buckets.setdefault(labels["stage"], []).append((float(labels["le"]), count))
+    sums = {dict(labels)["stage"]: value for labels, value in _delta(after, before, "stage_duration_seconds_sum").items()}
+    errors = {dict(labels)["stage"]: value for labels, value in _delta(after, before, "stage_errors_total").items()}
+    stats = {}
+    for stage, stage_buckets in sorted(buckets.items()):
+        stage_buckets.sort()
+        count = stage_buckets[-1][1]
+        if count <= 0:
+            continue
+        stats[stage] = {
+            "count": int(count),
+            "errors": int(errors.get(stage, 0)),
+            "mean": sums.get(stage, 0.0) / count,
+            "p50": histogram_quantile(0.50, stage_buckets),
+            "p95": histogram_quantile(0.95, stage_buckets),
+            "p99": histogram_quantile(0.99, stage_buckets),
+            "rps": count / elapsed,
+        }
+    return stats
+
+
+def counter_deltas(after: Samples, before: Samples, name: str, label: str) -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    for labels, value in _delta(after, before, name).items():
+        key = dict(labels).get(label, "")
+        totals[key] = totals.get(key, 0) + int(value)
+    return {key: value for key, value in sorted(totals.items()) if value}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Client:
+    def __init__(self, base_url: str, secret: str):
+        self.base_url = base_url
+        self.secret = secret
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def post(self, category: str, text: str) -> dict:
+        payload = payloads.webhook(text, self.secret)
+        sent_at = time.time()
+        started = time.perf_counter()
+        try:
+            res = self._session().post(
+                f"{self.base_url}/callback", data=payload["body"].encode("utf-8"), timeout=120,
+                headers={"Content-Type": "application/json", "X-Line-Signature": payload["signature"]},
+            )
+            status = res.status_code
+        except requests.RequestException:
+            status = 0
+        return {
+            "category": category, "status": status, "latency": time.perf_counter() - started,
+            "sent_at": sent_at, "reply_token": payload["reply_token"],
+        }
+
+    def metrics(self) -> Samples:
+        res = self._session().get(f"{self.base_url}/metrics", timeout=10)
+        res.raise_for_status()
+        return parse_metrics(res.text)
+
+
+def wait_ready(client: Client, server: subprocess.Popen, log_path: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            client.metrics()
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        tail = f.read()[-2000:]
+    raise SystemExit(f"gunicorn did not come up:\n{tail}")
+
+
+def wait_replies(stub_url: str, tokens: List[str], timeout: float) -> Dict[str, float]:
+    deadline = time.monotonic() + timeout
+    while True:
+        replies = requests.get(f"{stub_url}/_bench/replies", timeout=10).json()["replies"]
+        if all(token in replies for token in tokens) or time.monotonic() >= deadline:
+            return replies
+        time.sleep(0.2)
+
+
+def run_load(client: Client, messages: List[Tuple[str, str]], concurrency: int) -> Tuple[List[dict], float]:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda message: client.post(*message), messages))
+    return results, time.perf_counter() - started
+
+
+def http_stats(results: List[dict], elapsed: float) -> Dict[str, dict]:
+    groups = {"all": results}
+    for result in results:
+        groups.setdefault(result["category"], []).append(result)
+    stats = {}
+    for name, group in groups.items():
+        ok = [r for r in group if r["status"] == 200]
+        stats[name] = dict(
+            summarize([r["latency"] for r in ok]), errors=len(group) - len(ok), rps=len(group) / elapsed
+        )
+    return stats
+
+
+def reply_stats(results: List[dict], replies: Dict[str, float], elapsed: float) -> Dict[str, dict]:
+    groups: Dict[str, List[float]] = {"all": []}
+    missing = {"all": 0}
+    for result in results:
+        if result["status"] != 200:
+            continue
+        replied_at = replies.get(result["reply_token"])
+        for name in ("all", result["category"]):
+            if replied_at is None:
+                missing[name] = missing.get(name, 0) + 1
+            else:
+                groups.setdefault(name, []).append(replied_at - result["sent_at"])
+    return {
+        name: dict(summarize(groups.get(name, [])), missing=missing.get(name, 0), rps=len(groups.get(name, [])) / elapsed)
+        for name in sorted(set(groups) | set(missing), key=lambda n: (n != "all", n))
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="messages posted after the warm-up")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads posting at once")
+    parser.add_argument("--warmup", type=int, default=10, help="messages posted first and left out of the results")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn threads per worker")
+    parser.add_argument("--async", dest="async_webhooks", action="store_true", help="run the app with ASYNC_WEBHOOKS=1")
+    parser.add_argument("--mix", default=payloads.DEFAULT_MIX, help="comma-separated CATEGORY=WEIGHT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=("pinecone", "local"), default="pinecone",
+                        help="VECTOR_BACKEND; pinecone talks to the stub")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory with the gunicorn log")
+    parser.add_argument("--out", help="result file (default: bench/results/loadtest-<commit>-<time>.json)")
+    stubs.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    stub_server, stub_state = stubs.start_from_args(args)
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    env = dict(os.environ, **stubs.stub_env(stub_state.base_url))
+    env.update({
+        "VECTOR_BACKEND": args.backend,
+        "ASYNC_WEBHOOKS": "1" if args.async_webhooks else "0",
+        "INDEX_ON_STARTUP": "0",
+        "INDEX_MANIFEST_PATH": os.path.join(workdir, "index_manifest.json"),
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "vector_index"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+    })
+    log_path = os.path.join(workdir, "gunicorn.log")
+    server = None
+    try:
+        started = time.perf_counter()
+        ingest = subprocess.run([sys.executable, "ingest.py"], cwd=ROOT, env=env, capture_output=True, text=True)
+        ingest_seconds = time.perf_counter() - started
+        if ingest.returncode != 0:
+            raise SystemExit(f"ingest.py failed:\n{ingest.stdout}{ingest.stderr[-2000:]}")
+        print(f"Index built against the stubs in {ingest_seconds:.1f}s: {ingest.stdout.splitlines()[0]}")
+
+        port = _free_port()
+        with open(log_path, "w") as log:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+                 "--workers", str(args.workers), "--threads", str(args.threads), "--worker-class", "gthread",
+                 "--timeout", "120"],
+                cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        client = Client(f"http://127.0.0.1:{port}", env["LINE_CHANNEL_SECRET"])
+        wait_ready(client, server, log_path)
+        if args.workers > 1:
+            print(f"Warning: {args.workers} workers; per-stage figures cover only the worker each scrape reaches.")
+
+        messages = payloads.generate(args.warmup + args.requests, args.mix, args.seed)
+        reply_timeout = float(env.get("REPLY_BUDGET_SECONDS", "20")) + 10
+        warmup, _ = run_load(client, messages[:args.warmup], 1)
+        wait_replies(stub_state.base_url, [r["reply_token"] for r in warmup if r["status"] == 200], reply_timeout)
+        before = client.metrics()
+
+        print(f"Posting {args.requests} messages from {args.concurrency} threads...")
+        results, elapsed = run_load(client, messages[args.warmup:], args.concurrency)
+        replies = wait_replies(stub_state.base_url, [r["reply_token"] for r in results if r["status"] == 200], reply_timeout)
+        # Until the last reply, which in async mode comes after the last HTTP response
+        replied = [replies[r["reply_token"]] for r in results if r["reply_token"] in replies]
+        replied_elapsed = max(max(replied) - min(r["sent_at"] for r in results), elapsed) if replied else elapsed
+        after = client.metrics()
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        stub_server.shutdown()
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "run": run_info("loadtest", args),
+        "ingest_seconds": ingest_seconds,
+        "elapsed_seconds": elapsed,
+        "http": http_stats(results, elapsed),
+        "reply": reply_stats(results, replies, replied_elapsed),
+        "stages": stage_stats(after, before, replied_elapsed),
+        "routes": counter_deltas(after, before, "messages_total", "route"),
+        "llm_outcomes": counter_deltas(after, before, "llm_requests_total", "outcome"),
+        "stub_requests": stub_state.requests,
+        "stub_errors": stub_state.errors,
+    }
+
+    print_table("http", [(name, stats, stats["rps"]) for name, stats in result["http"].items()])
+    print_table("reply", [(name, stats, stats["rps"]) for name, stats in result["reply"].items()])
+    print_table("stage", [(name, stats, stats["rps"]) for name, stats in result["stages"].items()])
+    print(f"routes: {result['routes']}  llm: {result['llm_outcomes']}")
+    print(f"Results written to {write_result(result, args.out, 'loadtest')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Micro-benchmarks of PDFProcessor._populate_index() and search() against the stubs.
+
+Usage:
+    python bench/micro.py [--repeat 5] [--queries 20] [--backend local|pinecone]
+                          [--latency SERVICE=SECONDS ...] [--out FILE]
+
+Cases:
+    populate_cold       no manifest, page cache or embedding cache: read, parse, chunk, embed, upsert
+    populate_force      _populate_index(force=True) with warm caches: chunk and upsert only
+    populate_unchanged  manifest up to date: hash the PDFs and rebuild the lexical index
+    search_lexical      part-number questions, answered by BM25 alone
+    search_hybrid       free-form questions, BM25 plus vector search with cached query embeddings
+    search_hybrid_cold  the same with the embedding cache cleared, so each query calls Cohere
+Cohere (and Pinecone with --backend pinecone) are the in-process stubs from
+bench/stubs.py; give them latency with --latency to see its share. Index
+files and caches go to a temporary directory.
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import payloads  # noqa: E402
+import stubs  # noqa: E402
+from report import print_table, run_info, summarize, write_result  # noqa: E402
+
+
+def measure(fn: Callable[[], object], repeat: int, setup: Optional[Callable[[], object]] = None) -> List[float]:
+    """Seconds per call of fn; setup runs before each call, untimed."""
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each populate case, passes over the questions")
+    parser.add_argument("--queries", type=int, default=20, help="questions per search case")
+    parser.add_argument("--backend", choices=("local", "pinecone"), default="local",
+                        help="VECTOR_BACKEND; pinecone talks to the stub")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logs")
+    parser.add_argument("--out", help="result file (default: bench/results/micro-<commit>-<time>.json)")
+    stubs.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    stub_server, stub_state = stubs.start_from_args(args)
+    workdir = tempfile.mkdtemp(prefix="micro-")
+    os.environ.update(stubs.stub_env(stub_state.base_url))
+    os.environ.update({
+        "VECTOR_BACKEND": args.backend,
+        "INDEX_ON_STARTUP": "0",
+        "INDEX_MANIFEST_PATH": os.path.join(workdir, "index_manifest.json"),
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "vector_index"),
+        "EMBEDDING_CACHE_PATH": "",
+        "PDF_TEXT_CACHE_PATH": os.path.join(workdir, "pdf_text.sqlite3"),
+    })
+    # app reads its configuration at import time
+    import app
+    from pdf_text import PdfTextExtractor
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    benchmarks = {}
+    try:
+        processor = app.PDFProcessor(populate=False)
+        cold_runs = iter(range(args.repeat))
+
+        def reset():
+            # Forget everything: the manifest, the embeddings and (with a new file) the page texts
+            if os.path.exists(app.INDEX_MANIFEST_PATH):
+                os.remove(app.INDEX_MANIFEST_PATH)
+            processor.embedding_cache.memory.clear()
+            processor.pdf_text = PdfTextExtractor(
+                app.PDF_DIR, os.path.join(workdir, f"pdf_text-cold-{next(cold_runs)}.sqlite3"),
+                workers=app.PDF_EXTRACT_WORKERS, download_workers=app.INGEST_WORKERS
+            )
+
+        benchmarks["populate_cold"] = measure(processor._populate_index, args.repeat, reset)
+        benchmarks["populate_force"] = measure(lambda: processor._populate_index(force=True), args.repeat)
+        summary = processor._populate_index()
+        benchmarks["populate_unchanged"] = measure(processor._populate_index, args.repeat)
+
+        rng = random.Random(args.seed)
+        messages = payloads.load_messages()
+        lexical = [text for text in messages["part"] if app.product_index.find_by_part_no(text)]
+        lexical = rng.sample(lexical, min(args.queries, len(lexical)))
+        hybrid = [rng.choice(messages["free"]) for _ in range(args.queries)]
+
+        def search_each(queries: List[str], setup: Optional[Callable[[], object]] = None) -> List[float]:
+            timings = []
+            for _ in range(args.repeat):
+                for query in queries:
+                    timings.extend(measure(lambda: processor.search(query), 1, setup))
+            return timings
+
+        benchmarks["search_lexical"] = search_each(lexical)
+        # One untimed pass fills the embedding cache
+        for query in hybrid:
+            processor.search(query)
+        benchmarks["search_hybrid"] = search_each(hybrid)
+        benchmarks["search_hybrid_cold"] = search_each(hybrid, processor.embedding_cache.memory.clear)
+    finally:
+        stub_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "run": run_info("micro", args),
+        "index": {"chunks": len(processor.lexical_index), "summary": summary},
+        "benchmarks": {name: dict(summarize(timings), min=min(timings)) for name, timings in benchmarks.items()},
+        "stub_requests": stub_state.requests,
+    }
+    print_table("benchmark", [(name, stats) for name, stats in result["benchmarks"].items()], with_rps=False)
+    print(f"Results written to {write_result(result, args.out, 'micro')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Signed LINE webhook payloads with a realistic mix of messages.
+
+Usage:
+    python bench/payloads.py [--count 100] [--mix greeting=0.2,part=0.4,free=0.4] [--secret bench-secret]
+
+Prints one JSON object per line: {"category", "text", "reply_token", "body",
+"signature"}, ready to POST to /callback with an X-Line-Signature header.
+Categories follow the three routes through handle_message:
+    greeting  keywords from data/intents.json, answered without any lookup
+    part      part-number questions answered from data/all_products.json
+    free      free-form Thai spec questions that go through retrieval and the LLM
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTENTS_PATH = os.path.join(ROOT, "data", "intents.json")
+PRODUCTS_PATH = os.path.join(ROOT, "data", "all_products.json")
+DEFAULT_MIX = "greeting=0.2,part=0.4,free=0.4"
+DEFAULT_SECRET = "bench-secret"
+
+PART_TEMPLATES = [
+    "สเปค {part_no}",
+    "ขอ datasheet {part_no} หน่อย",
+    "{alias} ของ {part_no} เท่าไหร่",
+    "{part_no} {alias}",
+    "รุ่น {part_no} มี{alias}เท่าไร",
+]
+PART_ALIASES = ["Uc", "Up", "Iimp", "Imax", "แรงดัน", "น้ำหนัก", "อุณหภูมิใช้งาน", "ฟิวส์", "มาตรฐาน", "ขนาดสาย"]
+FREE_QUESTIONS = [
+    "อุปกรณ์ป้องกันฟ้าผ่าสำหรับเสาสัญญาณมือถือมีรุ่นไหนบ้าง",
+    "ถ้าใช้ระบบไฟแบบ TT ควรเลือกอุปกรณ์ป้องกันไฟกระชากตัวไหน",
+    "ติดตั้งบนราง DIN ได้ไหม",
+    "ต้องใช้ฟิวส์สำรองขนาดเท่าไหร่ถึงจะปลอดภัย",
+    "อุปกรณ์ตัวไหนมีหน้าสัมผัสแจ้งเตือนระยะไกล",
+    "เปลี่ยนโมดูลป้องกันเองได้หรือเปล่า ต้องใช้เครื่องมือไหม",
+    "กันฟ้าผ่าโดยตรงกับกันไฟกระชากต่างกันยังไง",
+    "ใช้กับระบบโซลาร์เซลล์ได้หรือไม่",
+    "ตัวไหนทนกระแสฟ้าผ่าได้สูงที่สุด",
+    "ช่วยแนะนำอุปกรณ์สำหรับตู้ไฟหลักในโรงงานหน่อย",
+    "อุณหภูมิใช้งานต่ำสุดกี่องศา ใช้ในห้องเย็นได้ไหม",
+    "เวลาตอบสนองของอุปกรณ์ป้องกันไฟกระชากเร็วแค่ไหน",
+    "แต่ละรุ่นได้มาตรฐาน IEC อะไรบ้าง",
+    "ต้องต่อสายดินขนาดเท่าไหร่",
+    "ถ้าอุปกรณ์เสียจะรู้ได้อย่างไร",
+]
+
+
+def load_messages(intents_path: str = INTENTS_PATH, products_path: str = PRODUCTS_PATH) -> Dict[str, List[str]]:
+    """Candidate message texts per category."""
+    with open(intents_path, encoding="utf-8") as f:
+        greetings = json.load(f)["intents"]["greeting"]["keywords"]
+    with open(products_path, encoding="utf-8") as f:
+        products = json.load(f)["products"]
+    parts = []
+    for product in products:
+        # Customers write part numbers with and without the space used in the catalogue
+        for part_no in {product["part_no"], product["product_id"], product["part_no"].replace(" ", "-")}:
+            for template in PART_TEMPLATES:
+                parts.extend(template.format(part_no=part_no, alias=alias) for alias in PART_ALIASES)
+    return {"greeting": greetings, "part": sorted(set(parts)), "free": list(FREE_QUESTIONS)}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in filter(None, (part.strip() for part in mix.split(","))):
+        category, _, weight = item.partition("=")
+        if category not in ("greeting", "part", "free"):
+            raise ValueError(f"unknown message category {category!r}, expected greeting, part or free")
+        weights[category] = float(weight)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError(f"message mix {mix!r} has no positive weight")
+    return weights
+
+
+def generate(count: int, mix: str = DEFAULT_MIX, seed: int = 0) -> List[Tuple[str, str]]:
+    """count (category, text) pairs drawn with the weights in mix; the same seed gives the same messages."""
+    rng = random.Random(seed)
+    messages = load_messages()
+    weights = parse_mix(mix)
+    categories = rng.choices(list(weights), weights=list(weights.values()), k=count)
+    return [(category, rng.choice(messages[category])) for category in categories]
+
+
+def sign(body: str, secret: str) -> str:
+    return base64.b64encode(hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()).decode("ascii")
+
+
+def webhook(text: str, secret: str = DEFAULT_SECRET, user_id: str = "Ubench") -> dict:
+    """One text message event as LINE sends it: {"text", "reply_token", "body", "signature"}."""
+    reply_token = uuid.uuid4().hex
+    event = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper(),
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": reply_token,
+        "message": {"id": str(uuid.uuid4().int % 10**18), "type": "text", "text": text, "quoteToken": uuid.uuid4().hex},
+    }
+    body = json.dumps({"destination": "Ubench", "events": [event]}, ensure_ascii=False)
+    return {"text": text, "reply_token": reply_token, "body": body, "signature": sign(body, secret)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma-separated CATEGORY=WEIGHT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--secret", default=DEFAULT_SECRET, help="LINE_CHANNEL_SECRET of the app under test")
+    args = parser.parse_args(argv)
+
+    for category, text in generate(args.count, args.mix, args.seed):
+        print(json.dumps(dict(webhook(text, args.secret), category=category), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
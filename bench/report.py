@@ -0,0 +1,89 @@
+"""Shared helpers for the benchmark scripts: percentiles, run metadata and JSON results.
+
+Every result file has a "run" block (git commit, time, host, arguments) so two
+runs can be compared with bench/compare.py.
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """q-th percentile (0-100) with linear interpolation between the closest ranks."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    """count, mean, p50/p95/p99 and max of latencies in seconds."""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return f"{commit}-dirty" if commit and dirty else commit or None
+
+
+def run_info(benchmark: str, args) -> dict:
+    return {
+        "benchmark": benchmark,
+        "commit": _git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key != "out"},
+    }
+
+
+def write_result(result: dict, out: Optional[str], benchmark: str) -> str:
+    """Writes result as JSON to out, or to bench/results/<benchmark>-<commit>-<time>.json."""
+    if not out:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        out = os.path.join(RESULTS_DIR, f"{benchmark}-{result['run'].get('commit') or 'nogit'}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return out
+
+
+def format_row(name: str, stats: dict, rps: Optional[float] = None) -> str:
+    def ms(value):
+        return f"{value * 1000:9.1f}" if value is not None else f"{'-':>9}"
+
+    row = f"{name:<24}{stats['count']:>7}{ms(stats['p50'])}{ms(stats['p95'])}{ms(stats['p99'])}"
+    return row + (f"{rps:9.1f}" if rps is not None else "")
+
+
+def print_table(title: str, rows: List[tuple], with_rps: bool = True):
+    header = f"{title:<24}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}" + (f"{'rps':>9}" if with_rps else "")
+    print(header)
+    for row in rows:
+        print(format_row(*row))
@@ -0,0 +1,261 @@
+"""Local stand-ins for LINE, Cohere, Pinecone and OpenRouter on one port.
+
+Usage:
+    python bench/stubs.py [--port 8090] [--latency SERVICE=SECONDS ...] [--error-rate SERVICE=RATE ...]
+                          [--first-token 0.8] [--token-delay 0.02] [--tokens 60]
+
+SERVICE is one of line, cohere, pinecone, openrouter. The API paths of the
+four services do not overlap, so one server answers all of them; stub_env()
+returns the environment variables that point the app (and the Cohere and
+Pinecone SDKs) at it. Cohere embeddings are hashed bags of words, so vector
+search over the real datasheet chunks returns plausible neighbours, and the
+Pinecone stub keeps vectors in memory. GET /_bench/replies returns when each
+LINE reply token was answered, so async replies can be timed end to end.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import numpy as np
+
+from fake_openrouter import send_json, write_completion
+
+SERVICES = ("line", "cohere", "pinecone", "openrouter")
+DIMENSION = 1024
+INDEX_NAME = "hipurino-index1"
+WORD = re.compile(r"\w+")
+
+
+def stub_env(base_url: str) -> Dict[str, str]:
+    """Environment for app.py, ingest.py and the SDKs to talk to the stubs at base_url."""
+    return {
+        "LINE_API_HOST": base_url,
+        "CO_API_URL": base_url,
+        "PINECONE_CONTROLLER_HOST": base_url,
+        "OPENROUTER_URL": f"{base_url}/api/v1/chat/completions",
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-token",
+        "LINE_CHANNEL_SECRET": "bench-secret",
+        "COHERE_API_KEY": "bench-cohere",
+        "PINECONE_API_KEY": "bench-pinecone",
+        "OPENROUTER_API_KEY": "bench-openrouter",
+    }
+
+
+def embed_text(text: str) -> list:
+    vector = np.zeros(DIMENSION, dtype=np.float32)
+    for word in WORD.findall(text.casefold()):
+        vector[int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % DIMENSION] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class StubState:
+    def __init__(self, latency: Dict[str, float], error_rate: Dict[str, float], first_token: float,
+                 token_delay: float, tokens: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.first_token = first_token
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.lock = threading.Lock()
+        self.vectors: Dict[str, dict] = {}
+        self.replies: Dict[str, float] = {}
+        self.requests: Dict[str, int] = {service: 0 for service in SERVICES}
+        self.errors: Dict[str, int] = {service: 0 for service in SERVICES}
+        self.base_url = ""
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _body(self) -> dict:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        def _service(self) -> Optional[str]:
+            path = self.path.split("?", 1)[0]
+            if path.startswith("/v2/bot/"):
+                return "line"
+            if path.startswith("/v1/"):
+                return "cohere"
+            if path.startswith("/api/v1/chat/completions"):
+                return "openrouter"
+            if path.startswith(("/indexes", "/query", "/vectors", "/describe_index_stats")):
+                return "pinecone"
+            return None
+
+        def _handle(self, method: str):
+            path = self.path.split("?", 1)[0]
+            if path == "/_bench/replies":
+                with state.lock:
+                    send_json(self, 200, {"replies": dict(state.replies), "requests": state.requests, "errors": state.errors})
+                return
+            service = self._service()
+            if service is None:
+                send_json(self, 404, {"message": f"no stub for {method} {path}"})
+                return
+            body = self._body() if method in ("POST", "PATCH") else {}
+            with state.lock:
+                state.requests[service] += 1
+            if random.random() < state.error_rate.get(service, 0.0):
+                with state.lock:
+                    state.errors[service] += 1
+                send_json(self, 503, {"message": f"stub {service} error", "error": {"code": 503, "message": "stub error"}})
+                return
+            if service != "openrouter":
+                time.sleep(state.latency.get(service, 0.0))
+            getattr(self, f"_{service}")(method, path, body)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        def _line(self, method: str, path: str, body: dict):
+            if path == "/v2/bot/message/reply":
+                with state.lock:
+                    state.replies[body.get("replyToken", "")] = time.time()
+            send_json(self, 200, {"sentMessages": [{"id": "1", "quoteToken": "q"}]})
+
+        def _cohere(self, method: str, path: str, body: dict):
+            if path.endswith("/check-api-key"):
+                send_json(self, 200, {"valid": True})
+                return
+            texts = body.get("texts", [])
+            send_json(self, 200, {
+                "id": "bench", "response_type": "embeddings_floats", "texts": texts, "embeddings": [embed_text(t) for t in texts],
+                "meta": {"api_version": {"version": "1"}},
+            })
+
+        def _pinecone(self, method: str, path: str, body: dict):
+            # Both the current (schema/deployment) and the older (dimension/spec) description shapes
+            description = {
+                "name": INDEX_NAME, "dimension": DIMENSION, "metric": "cosine", "host": state.base_url,
+                "vector_type": "dense", "deletion_protection": "disabled",
+                "spec": {"serverless": {"cloud": "aws", "region": "us-east-1"}},
+                "schema": {"fields": {"values": {"type": "dense_vector", "dimension": DIMENSION, "metric": "cosine"}}},
+                "deployment": {"deployment_type": "managed", "cloud": "aws", "region": "us-east-1"},
+                "status": {"ready": True, "state": "Ready"},
+            }
+            if path == "/indexes" and method == "GET":
+                send_json(self, 200, {"indexes": [description]})
+            elif path.startswith("/indexes"):
+                send_json(self, 200 if method != "POST" else 201, description)
+            elif path == "/vectors/upsert":
+                with state.lock:
+                    for v in body.get("vectors", []):
+                        state.vectors[v["id"]] = v
+                send_json(self, 200, {"upsertedCount": len(body.get("vectors", []))})
+            elif path == "/vectors/delete":
+                with state.lock:
+                    if body.get("deleteAll"):
+                        state.vectors.clear()
+                    for i in body.get("ids") or []:
+                        state.vectors.pop(i, None)
+                send_json(self, 200, {})
+            elif path == "/query":
+                self._query(body)
+            else:
+                send_json(self, 200, {"namespaces": {}, "dimension": DIMENSION, "totalVectorCount": len(state.vectors)})
+
+        def _query(self, body: dict):
+            with state.lock:
+                vectors = list(state.vectors.values())
+            query = np.asarray(body.get("vector", []), dtype=np.float32)
+            matches = []
+            if vectors and query.size:
+                matrix = np.asarray([v["values"] for v in vectors], dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+                scores = matrix @ query / np.where(norms, norms, 1.0)
+                for row in np.argsort(-scores)[:body.get("topK", 10)]:
+                    match = {"id": vectors[row]["id"], "score": float(scores[row]), "values": []}
+                    if body.get("includeMetadata"):
+                        match["metadata"] = vectors[row].get("metadata", {})
+                    matches.append(match)
+            send_json(self, 200, {"matches": matches, "namespace": body.get("namespace", "")})
+
+        def _openrouter(self, method: str, path: str, body: dict):
+            first_token = state.first_token + state.latency.get("openrouter", 0.0)
+            write_completion(self, body, first_token, state.token_delay, state.tokens)
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose (cancelled hedged LLM requests)
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def _knobs(items, name: str) -> Dict[str, float]:
+    knobs = {}
+    for item in items:
+        service, _, value = item.partition("=")
+        if service not in SERVICES:
+            raise SystemExit(f"{name}: unknown service {service!r}, expected one of {', '.join(SERVICES)}")
+        knobs[service] = float(value)
+    return knobs
+
+
+def start(port: int = 0, latency=None, error_rate=None, first_token: float = 0.8, token_delay: float = 0.02,
+          tokens: int = 60):
+    """Starts the stubs on a background thread; returns (server, state). Port 0 picks a free port."""
+    state = StubState(latency or {}, error_rate or {}, first_token, token_delay, tokens)
+    server = _Server(("127.0.0.1", port), make_handler(state))
+    state.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, name="bench-stubs", daemon=True).start()
+    return server, state
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=SECONDS",
+                        help="added latency per request (for openrouter: before the first token)")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="SERVICE=RATE",
+                        help="fraction of requests answered with HTTP 503")
+    parser.add_argument("--first-token", type=float, default=0.8, help="OpenRouter seconds to first answer token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="OpenRouter seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=60, help="OpenRouter answer length in tokens")
+
+
+def start_from_args(args, port: int = 0):
+    return start(port, _knobs(args.latency, "--latency"), _knobs(args.error_rate, "--error-rate"),
+                 args.first_token, args.token_delay, args.tokens)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8090)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    server, state = start_from_args(args, args.port)
+    print(f"Stubs on {state.base_url}; app environment:")
+    for key, value in stub_env(state.base_url).items():
+        print(f"  {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
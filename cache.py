@@ -0,0 +1,211 @@
+"""In-process caches for embeddings and LLM responses.
+
+LRUCache is a thread-safe, size-bounded LRU with an optional TTL.
+EmbeddingCache puts one in front of an optional SQLite tier, so embeddings
+survive restarts and are shared by gunicorn workers on the same host.
+ResponseCache memoises query_openrouter answers for repeated questions.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl or None
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, stored_at = item
+                if self.ttl is None or time.monotonic() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, age: float = 0.0):
+        """Stores value; age (seconds) counts against the TTL, for entries copied from an older tier."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() - age)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def items(self) -> List[tuple]:
+        """Snapshot of live (key, value) pairs, most recently used last."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value) for key, (value, stored_at) in self._data.items()
+                if self.ttl is None or now - stored_at < self.ttl
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+class EmbeddingCache:
+    def __init__(self, model: str, max_size: int = 1024, ttl: Optional[float] = None, path: Optional[str] = None):
+        self.model = model
+        self.ttl = ttl or None
+        self.memory = LRUCache(max_size, ttl)
+        self.disk_hits = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if path:
+            self._open_db(path)
+
+    def _open_db(self, path: str):
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, stored_at REAL NOT NULL)")
+            self._db = db
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding disk cache disabled, could not open {path}: {e}")
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    # Vectors are held as packed float32 arrays: a list of 1024 Python floats costs ~8x the memory
+    def get(self, text: str) -> Optional[List[float]]:
+        key = self.key(text)
+        packed = self.memory.get(key)
+        if packed is not None:
+            return packed.tolist()
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute("SELECT vector, stored_at FROM embeddings WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding disk cache read failed: {e}")
+            return None
+        if row is None or (self.ttl is not None and time.time() - row[1] >= self.ttl):
+            return None
+        packed = array("f", row[0])
+        self.disk_hits += 1
+        # Keep the disk entry's age, so promoting it to memory does not restart its TTL
+        self.memory.set(key, packed, age=max(time.time() - row[1], 0.0))
+        return packed.tolist()
+
+    def set(self, text: str, embedding: List[float]):
+        key = self.key(text)
+        packed = array("f", embedding)
+        self.memory.set(key, packed)
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, stored_at) VALUES (?, ?, ?)",
+                    (key, packed.tobytes(), time.time())
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding disk cache write failed: {e}")
+
+    def stats(self) -> dict:
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        stats["misses"] -= self.disk_hits
+        return stats
+
+
+def _unit(vector: List[float]) -> array:
+    norm = sum(x * x for x in vector) ** 0.5
+    return array("f", (x / norm for x in vector) if norm else vector)
+
+
+class ResponseCache:
+    """LLM answers keyed on (normalised question, context digest, model, temperature).
+
+    With semantic_distance > 0, a question whose embedding is within that
+    cosine distance of a cached question that retrieved the same context
+    reuses the cached answer. The embedding is passed as a callable and only
+    computed when the exact key misses.
+    """
+
+    def __init__(self, max_size: int = 512, ttl: Optional[float] = None, semantic_distance: float = 0.0):
+        self.entries = LRUCache(max_size, ttl)
+        self.semantic_distance = semantic_distance
+        self.semantic_hits = 0
+        self._version = None
+
+    def sync_version(self, version):
+        """Drops every entry when the index version (e.g. manifest mtime) changes."""
+        if version == self._version:
+            return
+        if self._version is not None:
+            logger.info(f"Index changed, clearing {len(self.entries)} cached responses.")
+            self.entries.clear()
+        self._version = version
+
+    def _key(self, question: str, context: str, model: str, temperature: float) -> tuple:
+        digest = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        return normalize_text(question), digest, model, temperature
+
+    def get(self, question: str, context: str, model: str, temperature: float,
+            embed: Optional[Callable[[], Optional[List[float]]]] = None) -> Optional[str]:
+        key = self._key(question, context, model, temperature)
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry[0]
+        if not self.semantic_distance or embed is None:
+            return None
+        embedding = embed()
+        if embedding is None:
+            return None
+        query = _unit(embedding)
+        for (_, *rest), (answer, cached) in self.entries.items():
+            if tuple(rest) != key[1:] or cached is None:
+                continue
+            if 1.0 - sum(a * b for a, b in zip(query, cached)) <= self.semantic_distance:
+                self.semantic_hits += 1
+                return answer
+        return None
+
+    def set(self, question: str, context: str, model: str, temperature: float, answer: str,
+            embedding: Optional[List[float]] = None):
+        key = self._key(question, context, model, temperature)
+        self.entries.set(key, (answer, _unit(embedding) if embedding is not None else None))
+
+    def stats(self) -> dict:
+        stats = self.entries.stats()
+        stats["semantic_hits"] = self.semantic_hits
+        stats["misses"] -= self.semantic_hits
+        return stats
@@ -0,0 +1,108 @@
+"""Structure-aware chunking for datasheet text.
+
+Text is split into units along datasheet structure (PDF pages, then one unit
+per spec key/value line), and units are packed into chunks up to a token budget
+without cutting a line in half. Consecutive chunks share up to
+overlap_tokens of trailing lines. Every chunk records its product id and page.
+"""
+import math
+import re
+from typing import Iterable, List, Optional
+
+# Words count one token plus one per 8 letters, numbers one per 3 digits, symbols one each, Thai one per 2 characters
+TOKEN_PIECES = re.compile(r"[A-Za-z]+|[\u0e00-\u0e7f]+|\d+|[^\sA-Za-z\d\u0e00-\u0e7f]")
+
+
+def count_tokens(text: str) -> int:
+    """Conservative estimate of BPE tokens; used to size chunks, not for billing."""
+    total = 0
+    for piece in TOKEN_PIECES.findall(text):
+        if "\u0e00" <= piece[0] <= "\u0e7f":
+            total += math.ceil(len(piece) / 2)
+        elif piece[0].isalpha():
+            total += 1 + len(piece) // 8
+        elif piece[0].isdigit():
+            total += math.ceil(len(piece) / 3)
+        else:
+            total += 1
+    return total
+
+
+def chunk_header(product_id: str) -> str:
+    """First line of every chunk of a product, so each chunk names the datasheet it came from."""
+    return f"Datasheet {product_id}"
+
+
+def split_units(text: str) -> List[str]:
+    """One unit per non-empty line; PyPDF2 emits one spec row per line in these datasheets."""
+    return [" ".join(line.split()) for line in text.splitlines() if line.strip()]
+
+
+def _split_long_unit(unit: str, max_tokens: int) -> List[str]:
+    pieces, current = [], []
+    for word in unit.split(" "):
+        if current and count_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+class Chunker:
+    def __init__(self, max_tokens: int = 480, overlap_tokens: int = 32):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def signature(self) -> str:
+        """Identifies the chunking settings, so a manifest built with other settings is rebuilt."""
+        return f"structured-v1:{self.max_tokens}:{self.overlap_tokens}"
+
+    def chunk_text(self, text: str, product_id: Optional[str] = None, page: Optional[int] = None,
+                   header: str = "") -> List[dict]:
+        header_tokens = count_tokens(header) if header else 0
+        budget = self.max_tokens - header_tokens
+        units = []
+        for unit in split_units(text):
+            units.extend(_split_long_unit(unit, budget) if count_tokens(unit) > budget else [unit])
+
+        chunks, current, current_tokens = [], [], 0
+        for unit in units:
+            tokens = count_tokens(unit)
+            if current and current_tokens + tokens > budget:
+                chunks.append(current)
+                # Carry trailing lines into the next chunk as overlap
+                carried, carried_tokens = [], 0
+                for prev in reversed(current):
+                    prev_tokens = count_tokens(prev)
+                    if carried_tokens + prev_tokens > self.overlap_tokens or carried_tokens + prev_tokens + tokens > budget:
+                        break
+                    carried.insert(0, prev)
+                    carried_tokens += prev_tokens
+                current, current_tokens = carried, carried_tokens
+            current.append(unit)
+            current_tokens += tokens
+        if current:
+            chunks.append(current)
+
+        result = []
+        for lines in chunks:
+            body = "\n".join(lines)
+            chunk = {"text": f"{header}\n{body}" if header else body}
+            if product_id is not None:
+                chunk["product_id"] = product_id
+            if page is not None:
+                chunk["page"] = page
+            result.append(chunk)
+        return result
+
+    def chunk_pages(self, pages: Iterable[str], product_id: Optional[str] = None) -> List[dict]:
+        """Chunks each PDF page separately; pages are numbered from 1."""
+        header = chunk_header(product_id) if product_id else ""
+        chunks = []
+        for number, page_text in enumerate(pages, start=1):
+            chunks.extend(self.chunk_text(page_text, product_id=product_id, page=number, header=header))
+        return chunks
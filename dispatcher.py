@@ -0,0 +1,86 @@
+"""Bounded worker pool that handles LINE webhook events off the request thread.
+
+/callback verifies the signature, submits the parsed events and returns at
+once; worker threads run the handler and send the reply. Events are
+deduplicated on their webhook event id so LINE redeliveries are not answered
+twice, and submit() refuses work when the queue is full so the caller can ask
+LINE to retry later. The handler gets the time.monotonic() at which the event
+was received, so time spent queued counts against its reply deadline.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class EventDispatcher:
+    def __init__(self, handle_event: Callable[[Any, float], None], workers: int = 8, queue_size: int = 100,
+                 dedupe_size: int = 4096, dedupe_ttl: float = 600.0):
+        self.handle_event = handle_event
+        self.workers = workers
+        self.duplicates = 0
+        self.rejected = 0
+        self._queue: "queue.Queue[Tuple[Any, float]]" = queue.Queue(maxsize=queue_size)
+        self._seen = LRUCache(dedupe_size, dedupe_ttl)
+        self._seen_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        # Started on first use rather than at import, so threads belong to the forked gunicorn worker
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, event, received_at: Optional[float] = None) -> bool:
+        """Queues an event received at received_at (time.monotonic(), default now). Returns False when the queue is full."""
+        self._start()
+        if received_at is None:
+            received_at = time.monotonic()
+        event_id = getattr(event, "webhook_event_id", None)
+        with self._seen_lock:
+            if event_id and self._seen.get(event_id):
+                self.duplicates += 1
+                logger.info(f"Skipping duplicate webhook event {event_id}")
+                return True
+            try:
+                self._queue.put_nowait((event, received_at))
+            except queue.Full:
+                self.rejected += 1
+                return False
+            if event_id:
+                self._seen.set(event_id, True)
+        return True
+
+    def _run(self):
+        while True:
+            event, received_at = self._queue.get()
+            try:
+                self.handle_event(event, received_at)
+            except Exception as e:
+                logger.error(f"Webhook worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def drain(self, timeout: float = 10.0):
+        """Waits up to timeout seconds for queued events to finish, e.g. on worker shutdown."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "workers": len(self._threads),
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+        }
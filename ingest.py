@@ -0,0 +1,38 @@
+"""Build the datasheet index once per deploy instead of inside every web worker.
+
+Usage:
+    python ingest.py            # index new or changed PDFs, drop removed ones
+    python ingest.py --force    # re-extract and re-embed every PDF
+
+Extracted text, chunks and embeddings are written to the index manifest
+(INDEX_MANIFEST_PATH) and upserted to the configured vector store (Pinecone, or
+the local index under LOCAL_INDEX_DIR when VECTOR_BACKEND=local). The web
+process only attaches to the existing index.
+"""
+import argparse
+import logging
+import sys
+
+from app import PDFProcessor, INDEX_MANIFEST_PATH, VECTOR_BACKEND
+
+logger = logging.getLogger("ingest")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Extract, embed and index the datasheet PDFs.")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and re-embed every PDF")
+    args = parser.parse_args(argv)
+
+    processor = PDFProcessor(populate=False)
+    logger.info(f"Building {VECTOR_BACKEND} index '{processor.store.name}' (manifest: {INDEX_MANIFEST_PATH})")
+    summary = processor._populate_index(force=args.force)
+    print(
+        f"indexed={summary['indexed']} unchanged={summary['unchanged']} "
+        f"removed={summary['removed']} empty={summary['empty']} failed={summary['failed']}"
+    )
+    print(f"embedding cache: {processor.embedding_cache.stats()}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Keyword intent matching for the canned replies in handle_message.
+
+All keywords from data/intents.json are compiled into one regular expression
+at import, longest keyword first, so a message is classified in a single
+pass: "ไม่ถูกใจเลย" matches the negative phrase rather than the positive
+"ถูกใจ" inside it. Keywords listed as standalone only match as whole words
+(optionally followed by a polite particle), since Thai has no spaces and
+short words such as "เท่" or "ชั่ว" also occur inside "เท่าไหร่" or "ชั่วโมง".
+Whole-message intents (greetings) match only when they are the entire message,
+apart from trailing polite particles.
+When several intents match, the lowest priority number wins.
+"""
+import json
+import logging
+import re
+from typing import Dict, Optional
+
+from cache import normalize_text as normalize
+
+logger = logging.getLogger(__name__)
+
+_LETTER = r"a-z\u0e00-\u0e7f"
+_TRAILING_PUNCTUATION = re.compile(r"[\s!?.~,]+$")
+
+
+class IntentMatcher:
+    def __init__(self, intents: Dict[str, dict], particles=()):
+        self.priorities = {name: spec.get("priority", 100) for name, spec in intents.items()}
+        self.keyword_intents: Dict[str, str] = {}
+        self.whole_message: Dict[str, str] = {}
+        alternatives = []
+        particles = "|".join(re.escape(normalize(p)) for p in sorted(particles, key=len, reverse=True))
+        word_end = f"(?=$|[^{_LETTER}]" + (f"|(?:{particles})" if particles else "") + ")"
+        # "สวัสดีครับ" is the greeting "สวัสดี" followed by polite particles
+        self.trailing_particles = re.compile(f"(?:\\s*(?:{particles}))+$") if particles else None
+        for name, spec in sorted(intents.items(), key=lambda item: self.priorities[item[0]]):
+            if spec.get("whole_message"):
+                for keyword in spec.get("keywords", []):
+                    self.whole_message.setdefault(normalize(keyword), name)
+                continue
+            for keyword in spec.get("keywords", []):
+                keyword = normalize(keyword)
+                if keyword not in self.keyword_intents:
+                    self.keyword_intents[keyword] = name
+                    alternatives.append((keyword, re.escape(keyword)))
+            for keyword in spec.get("standalone", []):
+                keyword = normalize(keyword)
+                if keyword not in self.keyword_intents:
+                    self.keyword_intents[keyword] = name
+                    alternatives.append((keyword, f"(?<![{_LETTER}]){re.escape(keyword)}{word_end}"))
+        # Python alternation is leftmost-first, so list longer keywords first to get the longest match
+        alternatives.sort(key=lambda item: len(item[0]), reverse=True)
+        self.pattern = re.compile("|".join(pattern for _, pattern in alternatives)) if alternatives else None
+
+    @classmethod
+    def load(cls, path: str) -> "IntentMatcher":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        matcher = cls(data.get("intents", {}), data.get("particles", ()))
+        logger.info(f"Intent matcher loaded: {len(matcher.keyword_intents)} keywords, {len(matcher.whole_message)} whole-message phrases")
+        return matcher
+
+    def classify(self, text: str) -> Optional[str]:
+        message = normalize(text)
+        whole = _TRAILING_PUNCTUATION.sub("", message)
+        best = self.whole_message.get(whole)
+        if best is None and self.trailing_particles is not None:
+            best = self.whole_message.get(_TRAILING_PUNCTUATION.sub("", self.trailing_particles.sub("", whole)))
+        if self.pattern is not None:
+            for match in self.pattern.finditer(message):
+                name = self.keyword_intents[match.group(0)]
+                if best is None or self.priorities[name] < self.priorities[best]:
+                    best = name
+        return best
@@ -0,0 +1,155 @@
+"""Streaming OpenRouter chat completions with a deadline and hedged model fallbacks.
+
+stream_completion() asks for "stream": true and reads the server-sent events
+as they arrive. Models are tried in order: when the current one has produced
+no answer token within hedge_after seconds (or fails), the next one is started
+alongside it, and the first to produce a token wins while the rest are
+cancelled. Whatever text has arrived by the deadline is returned, marked
+incomplete, so the caller can still reply before the LINE reply token expires.
+"""
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Completion:
+    text: str
+    model: Optional[str]
+    complete: bool
+    error: Optional[str] = None
+    # Seconds from the call to the winning model's first answer token
+    first_token: Optional[float] = None
+
+
+class _Attempt:
+    def __init__(self, model: str):
+        self.model = model
+        self.parts: List[str] = []
+        self.first_token_at: Optional[float] = None
+        self.done = False
+        self.error: Optional[str] = None
+        self.cancelled = False
+        self.response = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def cancel(self):
+        self.cancelled = True
+        response = self.response
+        if response is not None:
+            # Closing the connection unblocks the reader thread. close() waits for a read in progress,
+            # so it runs on its own thread rather than holding up the reply.
+            threading.Thread(target=_close_quietly, args=(response,), daemon=True).start()
+
+
+def _close_quietly(response):
+    try:
+        response.close()
+    except Exception:
+        pass
+
+
+def _iter_sse_data(response):
+    """Yields the data payload of each server-sent event; comment lines (": keep-alive") are skipped."""
+    # Event streams are always UTF-8; without a charset requests would decode them as ISO-8859-1
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith("data:"):
+            yield line[5:].strip()
+
+
+def _stream(attempt: _Attempt, url: str, headers: dict, payload: dict, deadline: float, changed: threading.Condition):
+    try:
+        timeout = max(deadline - time.monotonic(), 0.1)
+        attempt.response = requests.post(
+            url, headers=headers, json=dict(payload, model=attempt.model, stream=True), stream=True, timeout=timeout
+        )
+        attempt.response.raise_for_status()
+        for data in _iter_sse_data(attempt.response):
+            if attempt.cancelled or data == "[DONE]":
+                break
+            event = json.loads(data)
+            if "error" in event:
+                raise RuntimeError(event["error"].get("message", event["error"]))
+            choices = event.get("choices") or [{}]
+            # Reasoning models stream their reasoning separately; only the answer is sent to the user
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                with changed:
+                    attempt.parts.append(content)
+                    if attempt.first_token_at is None:
+                        attempt.first_token_at = time.monotonic()
+                        changed.notify_all()
+    except Exception as e:
+        if not attempt.cancelled:
+            attempt.error = str(e)
+    finally:
+        with changed:
+            attempt.done = True
+            changed.notify_all()
+
+
+def stream_completion(url: str, headers: dict, payload: dict, models: Sequence[str], deadline: float,
+                      hedge_after: float) -> Completion:
+    """Runs the chat completion in payload against models (in order) until deadline (time.monotonic())."""
+    started_at = time.monotonic()
+    changed = threading.Condition()
+    attempts: List[_Attempt] = []
+    winner: Optional[_Attempt] = None
+    last_launch = 0.0
+
+    def launch():
+        nonlocal last_launch
+        attempt = _Attempt(models[len(attempts)])
+        attempts.append(attempt)
+        last_launch = time.monotonic()
+        threading.Thread(
+            target=_stream, args=(attempt, url, headers, payload, deadline, changed),
+            name=f"llm-{attempt.model}", daemon=True
+        ).start()
+        if len(attempts) > 1:
+            logger.info(f"No answer token from {attempts[-2].model}, also trying {attempt.model}")
+
+    with changed:
+        launch()
+        while True:
+            now = time.monotonic()
+            if winner is None:
+                started = [a for a in attempts if a.first_token_at is not None]
+                if started:
+                    winner = min(started, key=lambda a: a.first_token_at)
+                    for attempt in attempts:
+                        if attempt is not winner:
+                            attempt.cancel()
+            if winner is not None and winner.done:
+                break
+            if now >= deadline:
+                break
+            wake_at = deadline
+            if winner is None and len(attempts) < len(models):
+                if all(a.done for a in attempts) or now >= last_launch + hedge_after:
+                    launch()
+                    continue
+                wake_at = min(wake_at, last_launch + hedge_after)
+            elif winner is None and all(a.done for a in attempts):
+                break
+            changed.wait(wake_at - now)
+
+        for attempt in attempts:
+            if attempt is not winner or not attempt.done:
+                attempt.cancel()
+        if winner is not None:
+            complete = winner.done and winner.error is None
+            return Completion(winner.text.strip(), winner.model, complete, winner.error, winner.first_token_at - started_at)
+    errors = "; ".join(f"{a.model}: {a.error or 'no answer before deadline'}" for a in attempts)
+    return Completion("", None, False, errors)
@@ -0,0 +1,255 @@
+"""In-process metrics in the Prometheus text format, plus an opt-in sampling profiler.
+
+span("stage") times a block into the stage_duration_seconds histogram.
+Counters and gauges are plain objects updated on the hot path with one lock
+each; collectors registered with REGISTRY.collector() are called at scrape
+time to export stats that other components already keep (cache hit counts,
+dispatcher queue depth). Metrics are per process: with several gunicorn
+workers each scrape sees the worker that served it, so scrape per worker or
+sum in Prometheus.
+
+SamplingProfiler samples one thread's stack every interval seconds from a
+background thread, so profiled requests run at close to full speed.
+"""
+import bisect
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers in-process lookups (sub-millisecond) up to a full LLM reply
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts with a final +Inf slot, sum)
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[slot] += 1
+            total[0] += value
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    result.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), cumulative))
+                result.append((f"{self.name}_sum", key, total[0]))
+                result.append((f"{self.name}_count", key, cumulative))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Tuple[str, str, str, Callable[[], Iterable[Sample]]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def collector(self, name: str, kind: str, help: str, collect: Callable[[], Iterable[Sample]]):
+        """Registers collect(), called on every scrape, returning (sample name, labels, value) tuples."""
+        with self._lock:
+            self._collectors.append((name, kind, help, collect))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, kind, help, collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                logger.warning(f"Metrics collector {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(
+                f"{sample}{_format_labels(sorted(labels.items()))} {_format_value(value)}" for sample, labels, value in samples
+            )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("stage_duration_seconds", "Time spent in each message pipeline stage.")
+STAGE_ERRORS = REGISTRY.counter("stage_errors_total", "Pipeline stages that raised.")
+
+
+@contextmanager
+def span(stage: str):
+    """Times the block into stage_duration_seconds{stage=...}; exceptions also count into stage_errors_total."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks: _Tally = _Tally()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def top(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Innermost frames by sample count."""
+        leaves: _Tally = _Tally()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+    def write_collapsed(self, path: str):
+        """Writes stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def maybe_profile(name: str, rate: float, interval: float = 0.005, directory: Optional[str] = None):
+    """Profiles the block with probability rate, logging the hottest frames and optionally saving the stacks."""
+    if rate <= 0 or random.random() >= rate:
+        yield
+        return
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        elapsed = time.perf_counter() - started
+        hottest = ", ".join(f"{frame} ({count})" for frame, count in profiler.top(5))
+        logger.info(f"Profile of {name}: {profiler.samples} samples over {elapsed:.3f}s; hottest: {hottest}")
+        if directory and profiler.samples:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                profiler.write_collapsed(os.path.join(directory, f"{name}-{int(time.time() * 1000)}.collapsed"))
+            except OSError as e:
+                logger.warning(f"Could not write profile to {directory}: {e}")
@@ -1,10 +1,13 @@
 import os
+import sys
 import requests
 import json
-import PyPDF2
-from io import BytesIO
 from flask import Flask, request, jsonify
 
+# pdf_text.py อยู่ที่ root ของ repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from pdf_text import PdfTextExtractor
+
 # --- การตั้งค่าคีย์สำคัญจาก Environment Variables ---
 CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
 CHANNEL_SECRET = os.environ.get('LINE_CHANNEL_SECRET')
@@ -30,23 +33,11 @@ PDF_URLS = [
 
 app = Flask(__name__)
 
+# อ่านไฟล์จาก pdfs/ ใน repo ก่อน (ดาวน์โหลดเฉพาะไฟล์ที่ไม่มี) และใช้ข้อความที่ cache ไว้ตอน build (python pdf_text.py)
+pdf_text = PdfTextExtractor()
+
 def read_pdfs_from_urls(pdf_urls):
-    all_text = ""
-    for url in pdf_urls:
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            with BytesIO(response.content) as pdf_file:
-                reader = PyPDF2.PdfReader(pdf_file)
-                for page in reader.pages:
-                    all_text += page.extract_text() + "\n"
-        except requests.exceptions.RequestException as e:
-            print(f"เกิดข้อผิดพลาดในการดาวน์โหลด PDF จาก {url}: {e}")
-        except PyPDF2.errors.PdfReadError as e:
-            print(f"เกิดข้อผิดพลาดในการอ่าน PDF จาก {url}: {e}")
-        except Exception as e:
-            print(f"ข้อผิดพลาดที่ไม่คาดคิดในการประมวลผล PDF จาก {url}: {e}")
-    return all_text.strip()
+    return "\n".join(pdf_text.iter_pages(pdf_urls)).strip()
 
 def query_openrouter(question, context):
     headers = {
@@ -0,0 +1,222 @@
+"""PDF text extraction with a persistent per-page cache.
+
+Datasheets are read from the local pdfs/ directory through mmap when the file
+is there (it ships with the repo) and downloaded from their URL otherwise.
+Extracted page texts are stored in a small SQLite file keyed by the PDF's
+sha256 and the PyPDF2 version, compressed, so a restart or a serverless cold
+start only hashes the files. Files are read and downloaded from a thread pool;
+cache misses are parsed in a process pool, since PyPDF2 is pure Python and
+holds the GIL.
+
+Usage:
+    python pdf_text.py          # warm the cache for every PDF in pdfs/
+"""
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import sys
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import PyPDF2
+import requests
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PDF_DIR = os.path.join(ROOT, "pdfs")
+CACHE_PATH = os.path.join(ROOT, "data", "pdf_text.sqlite3")
+# Page texts change when the extractor does, so the PyPDF2 version is part of the key
+EXTRACTOR_VERSION = f"pypdf2-{PyPDF2.__version__}"
+
+
+def _open_mapped(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def parse_pages(source: Union[str, bytes]) -> List[str]:
+    """Page texts of a PDF given as a file path (mmapped) or raw bytes. Runs in pool workers."""
+    if isinstance(source, str):
+        data = _open_mapped(source)
+        try:
+            return [page.extract_text() or "" for page in PyPDF2.PdfReader(data).pages]
+        finally:
+            data.close()
+    return [page.extract_text() or "" for page in PyPDF2.PdfReader(BytesIO(source)).pages]
+
+
+class PageCache:
+    def __init__(self, path: Optional[str]):
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        if path:
+            self._open_db(path)
+
+    def _open_db(self, path: str):
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS pages (sha256 TEXT NOT NULL, extractor TEXT NOT NULL, "
+                "pages BLOB NOT NULL, PRIMARY KEY (sha256, extractor))"
+            )
+            self._db = db
+        except (OSError, sqlite3.Error) as e:
+            # e.g. a read-only serverless filesystem without a prebuilt cache
+            logger.warning(f"PDF text cache disabled, could not open {path}: {e}")
+
+    def get(self, digest: str) -> Optional[List[str]]:
+        if self._db is None:
+            return None
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT pages FROM pages WHERE sha256 = ? AND extractor = ?", (digest, EXTRACTOR_VERSION)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"PDF text cache read failed: {e}")
+            return None
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def set(self, digest: str, pages: List[str]):
+        if self._db is None:
+            return
+        blob = zlib.compress(json.dumps(pages, ensure_ascii=False).encode("utf-8"))
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO pages (sha256, extractor, pages) VALUES (?, ?, ?)",
+                    (digest, EXTRACTOR_VERSION, blob)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"PDF text cache write failed: {e}")
+
+
+class PdfTextExtractor:
+    def __init__(self, pdf_dir: Optional[str] = PDF_DIR, cache_path: Optional[str] = CACHE_PATH,
+                 workers: Optional[int] = None, timeout: float = 10.0, download_workers: int = 4):
+        self.pdf_dir = pdf_dir
+        self.cache = PageCache(cache_path)
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.download_workers = download_workers
+        self.timeout = timeout
+        self.cache_hits = 0
+        self.parsed = 0
+
+    def local_path(self, url: str) -> Optional[str]:
+        if not self.pdf_dir:
+            return None
+        path = os.path.join(self.pdf_dir, url.rsplit("/", 1)[-1])
+        return path if os.path.isfile(path) else None
+
+    def load(self, url: str) -> Tuple[Optional[str], Optional[Union[str, bytes]]]:
+        """Returns (sha256, source) where source is a local path or the downloaded bytes; (None, None) on failure."""
+        path = self.local_path(url)
+        if path:
+            try:
+                data = _open_mapped(path)
+                try:
+                    return hashlib.sha256(data).hexdigest(), path
+                finally:
+                    data.close()
+            except (OSError, ValueError) as e:
+                # ValueError: mmap of an empty file
+                logger.warning(f"Could not map {path}, downloading instead: {e}")
+        try:
+            res = requests.get(url, timeout=self.timeout)
+            res.raise_for_status()
+            return hashlib.sha256(res.content).hexdigest(), res.content
+        except Exception as e:
+            logger.error(f"Download error [{url}]: {e}")
+            return None, None
+
+    def _parse_all(self, sources: Dict[str, Union[str, bytes]]) -> Iterator[Tuple[str, Optional[List[str]]]]:
+        if self.workers > 1 and len(sources) > 1:
+            try:
+                pool = ProcessPoolExecutor(max_workers=min(self.workers, len(sources)))
+            except (OSError, NotImplementedError) as e:
+                # No working multiprocessing (e.g. AWS Lambda has no /dev/shm)
+                logger.warning(f"Process pool unavailable, parsing PDFs inline: {e}")
+            else:
+                with pool:
+                    futures = {pool.submit(parse_pages, source): url for url, source in sources.items()}
+                    for future in as_completed(futures):
+                        try:
+                            yield futures[future], future.result()
+                        except Exception as e:
+                            logger.error(f"Extract error [{futures[future]}]: {e}")
+                            yield futures[future], None
+                return
+        for url, source in sources.items():
+            try:
+                yield url, parse_pages(source)
+            except Exception as e:
+                logger.error(f"Extract error [{url}]: {e}")
+                yield url, None
+
+    def documents(self, urls: Iterable[str], skip: Optional[Callable[[str, str], bool]] = None) -> Iterator[dict]:
+        """Yields {"url", "digest", "pages"} per PDF as soon as its pages are available.
+
+        Cached documents come first, then parsed ones in completion order. digest
+        is None when the PDF could not be read; pages is None when it could not
+        be parsed or when skip(url, digest) says the caller does not need it.
+        """
+        pending: Dict[str, Union[str, bytes]] = {}
+        digests: Dict[str, str] = {}
+        urls = list(urls)
+        # Downloads are I/O bound, so they overlap in threads; only parsing needs processes
+        with ThreadPoolExecutor(max_workers=max(1, min(self.download_workers, len(urls)))) as pool:
+            for url, (digest, source) in zip(urls, pool.map(self.load, urls)):
+                if digest is None:
+                    yield {"url": url, "digest": None, "pages": None}
+                    continue
+                if skip and skip(url, digest):
+                    yield {"url": url, "digest": digest, "pages": None}
+                    continue
+                pages = self.cache.get(digest)
+                if pages is not None:
+                    self.cache_hits += 1
+                    yield {"url": url, "digest": digest, "pages": pages}
+                    continue
+                pending[url] = source
+                digests[url] = digest
+        for url, pages in self._parse_all(pending):
+            if pages is not None:
+                self.parsed += 1
+                self.cache.set(digests[url], pages)
+            yield {"url": url, "digest": digests[url], "pages": pages}
+
+    def iter_pages(self, urls: Iterable[str]) -> Iterator[str]:
+        """Streams the non-empty page texts of every readable PDF, logging the ones that are not."""
+        for doc in self.documents(urls):
+            if doc["pages"] is None:
+                logger.error(f"Could not read PDF, skipping: {doc['url']}")
+                continue
+            for page in doc["pages"]:
+                if page:
+                    yield page
+
+    def stats(self) -> dict:
+        return {"cache_hits": self.cache_hits, "parsed": self.parsed}
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    extractor = PdfTextExtractor()
+    failed = 0
+    for doc in extractor.documents(sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf")))):
+        failed += doc["pages"] is None
+    print(f"{extractor.stats()} failed={failed} -> {CACHE_PATH}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""Deterministic product/spec lookup over data/all_products.json.
+
+Answers direct spec questions ("max backup fuse of 900368", "Iimp ของ 952 035")
+without an embedding, vector query or LLM call. ProductIndex.answer returns
+None when there is no deterministic hit so the caller can fall back to RAG.
+"""
+import bisect
+import json
+import logging
+import math
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# 6-digit DEHN part numbers, written either "900368" or "900 368" as in the PDFs
+PART_NO_PATTERN = re.compile(r"(?<!\d)(\d{3})[\s-]?(\d{3})(?!\d)")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u0e00-\u0e7f]+")
+STOP_TOKENS = {"of", "at", "to", "the", "for", "and", "acc"}
+
+# Datasheet symbols and Thai terms mapped to the words used in the spec keys
+SPEC_ALIASES = {
+    "iimp": "lightning impulse current",
+    "imax": "max discharge current",
+    "ifi": "follow current extinguishing capability",
+    "uc": "max continuous operating voltage",
+    "up": "voltage protection level",
+    "un": "nominal voltage",
+    "ta": "response time",
+    "isccr": "short circuit withstand capability",
+    "ipe": "protective conductor current",
+    "tov": "temporary overvoltage",
+    "ip": "degree protection",
+    "ฟิวส์": "fuse",
+    "แรงดัน": "voltage",
+    "กระแส": "current",
+    "น้ำหนัก": "weight",
+    "อุณหภูมิ": "temperature range",
+    "ใช้งาน": "operating",
+    "สูงสุด": "max",
+    "เวลาตอบสนอง": "response time",
+    "ขนาดสาย": "cross sectional area",
+    "พื้นที่หน้าตัด": "cross sectional area",
+    "วัสดุ": "material",
+    "การติดตั้ง": "installation",
+    "มาตรฐาน": "approvals",
+}
+# Symbols that are also ordinary words ("up to"); only treated as symbols when written with a capital
+CASED_ALIASES = {"up", "ta", "un", "ip"}
+SPEC_OVERVIEW_WORDS = ("spec", "สเปค", "สเปก", "datasheet", "ดาต้าชีท", "ข้อมูลสินค้า")
+MIN_KEY_COVERAGE = 0.6
+# Summed IDF of matched name tokens; one token unique to a product, or two shared ones
+MIN_NAME_SCORE = 2.0
+MIN_PREFIX_LENGTH = 3
+
+
+def normalize(text: str) -> str:
+    """normalize_text, also dropping the ® in product names ("DEHNguard®")."""
+    return normalize_text(text.replace("®", ""))
+
+
+def _tokens(text: str) -> Set[str]:
+    return set(TOKEN_PATTERN.findall(normalize(text))) - STOP_TOKENS
+
+
+def _is_thai(text: str) -> bool:
+    return "\u0e00" <= text[0] <= "\u0e7f"
+
+
+# NFKC rewrites some Thai vowels (e.g. sara am), so aliases are compared in normalised form
+_NORMALIZED_ALIASES = [(normalize(alias), _tokens(expansion)) for alias, expansion in SPEC_ALIASES.items()]
+
+
+def _flatten(specs: dict, prefix: str = "") -> Dict[str, str]:
+    flat = {}
+    for key, value in specs.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}_"))
+        else:
+            flat[f"{prefix}{key}"] = str(value)
+    return flat
+
+
+class ProductIndex:
+    def __init__(self, products: List[dict]):
+        self.products: Dict[str, dict] = {}
+        self.specs: Dict[str, Dict[str, str]] = {}
+        self.by_part_no: Dict[str, str] = {}
+        # name token -> product ids, with tokens kept sorted for prefix lookups
+        self.name_index: Dict[str, Set[str]] = defaultdict(set)
+        self.name_tokens: List[str] = []
+        self.name_idf: Dict[str, float] = {}
+        self.key_tokens: Dict[str, Set[str]] = {}
+        # spec key -> normalised value -> product ids
+        self.spec_values: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+        for product in products:
+            self._add(product)
+        self.name_tokens = sorted(self.name_index)
+        self.name_idf = {
+            token: math.log(len(self.products) / len(pids)) for token, pids in self.name_index.items()
+        }
+
+    @classmethod
+    def load(cls, path: str) -> "ProductIndex":
+        try:
+            with open(path, encoding="utf-8") as f:
+                products = json.load(f).get("products", [])
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load product data {path}: {e}")
+            products = []
+        index = cls(products)
+        logger.info(f"Product index loaded: {len(index.products)} products, {len(index.key_tokens)} spec keys")
+        return index
+
+    def _add(self, product: dict):
+        product_id = product["product_id"]
+        self.products[product_id] = product
+        self.by_part_no[product_id] = product_id
+        if product.get("part_no"):
+            self.by_part_no[re.sub(r"\D", "", product["part_no"])] = product_id
+        for token in _tokens(product.get("name", "")):
+            self.name_index[token].add(product_id)
+        specs = _flatten(product.get("specifications", {}))
+        self.specs[product_id] = specs
+        for key, value in specs.items():
+            self.key_tokens.setdefault(key, _tokens(key.replace("_", " ")))
+            self.spec_values[key][normalize(value)].add(product_id)
+
+    def find_by_part_no(self, text: str) -> List[str]:
+        found = []
+        for match in PART_NO_PATTERN.finditer(text):
+            product_id = self.by_part_no.get(match.group(1) + match.group(2))
+            if product_id and product_id not in found:
+                found.append(product_id)
+        return found
+
+    def _name_matches(self, token: str) -> List[str]:
+        if len(token) < MIN_PREFIX_LENGTH or token.isdigit():
+            return [token] if token in self.name_index else []
+        start = bisect.bisect_left(self.name_tokens, token)
+        matches = []
+        for name_token in self.name_tokens[start:]:
+            if not name_token.startswith(token):
+                break
+            matches.append(name_token)
+        return matches
+
+    def find_by_name(self, text: str) -> Optional[str]:
+        scores: Dict[str, float] = defaultdict(float)
+        matched: Set[str] = set()
+        for token in _tokens(text):
+            matched.update(self._name_matches(token))
+        for name_token in matched:
+            for product_id in self.name_index[name_token]:
+                scores[product_id] += self.name_idf[name_token]
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < MIN_NAME_SCORE:
+            return None
+        # Several names scoring the same means the question is ambiguous
+        if len(ranked) > 1 and math.isclose(ranked[1][1], ranked[0][1]):
+            return None
+        return ranked[0][0]
+
+    def _query_tokens(self, text: str) -> Set[str]:
+        normalized = normalize(text)
+        tokens = _tokens(normalized)
+        capitalized = {t.casefold() for t in re.findall(r"[A-Za-z0-9]+", text) if not t.islower()}
+        for alias, expansion in _NORMALIZED_ALIASES:
+            if alias in CASED_ALIASES:
+                matched = alias in capitalized
+            else:
+                # Thai has no word breaks, so Thai aliases match as substrings
+                matched = alias in tokens or (_is_thai(alias) and alias in normalized)
+            if matched:
+                tokens |= expansion
+        return tokens
+
+    def match_spec_key(self, text: str, keys=None) -> Optional[str]:
+        tokens = self._query_tokens(text)
+        best: Tuple[float, int, str] = (0.0, 0, "")
+        for key in keys if keys is not None else self.key_tokens:
+            key_tokens = self.key_tokens[key]
+            if not key_tokens:
+                continue
+            matched = len(key_tokens & tokens)
+            coverage = matched / len(key_tokens)
+            # Prefer full coverage, then more matched words, then the shorter (more general) key
+            candidate = (coverage, matched, key)
+            if (coverage, matched) > best[:2] or ((coverage, matched) == best[:2] and len(key) < len(best[2])):
+                best = candidate
+        coverage, matched, key = best
+        if coverage < MIN_KEY_COVERAGE or (matched < 2 and coverage < 1.0):
+            return None
+        return key
+
+    def _label(self, product_id: str) -> str:
+        product = self.products[product_id]
+        return f"{product.get('name', product_id)} (Part No. {product.get('part_no') or product_id})"
+
+    def _overview(self, product_id: str) -> str:
+        lines = [f"- {key.replace('_', ' ')}: {value}" for key, value in self.specs[product_id].items()]
+        return f"สเปคของ {self._label(product_id)}:\n" + "\n".join(lines)
+
+    def _named_products(self, question: str) -> List[str]:
+        product_ids = self.find_by_part_no(question)
+        if not product_ids:
+            name_match = self.find_by_name(question)
+            product_ids = [name_match] if name_match else []
+        return product_ids
+
+    def overview(self, question: str) -> Optional[str]:
+        """Full spec listing of the first product named in question, or None."""
+        product_ids = self._named_products(question)
+        return self._overview(product_ids[0]) if product_ids else None
+
+    def answer(self, question: str) -> Optional[str]:
+        product_ids = self._named_products(question)
+        if not product_ids:
+            return self._answer_by_value(question)
+        replies = []
+        for product_id in product_ids[:3]:
+            key = self.match_spec_key(question, self.specs[product_id].keys())
+            if key:
+                replies.append(f"{self._label(product_id)}\n{key.replace('_', ' ')}: {self.specs[product_id][key]}")
+            elif any(word in question.casefold() for word in SPEC_OVERVIEW_WORDS):
+                replies.append(self._overview(product_id))
+        return "\n\n".join(replies) or None
+
+    def _answer_by_value(self, question: str) -> Optional[str]:
+        # "which part has Iimp 25 kA": a spec key plus one of its known values, no product named
+        key = self.match_spec_key(question)
+        if not key:
+            return None
+        normalized = normalize(question)
+        # "0 g" must not match inside "120 g", and "12 kA" must lose to "112 kA"
+        matches = []
+        for value, product_ids in self.spec_values[key].items():
+            core = value.split("(")[0].strip()
+            if core and re.search(r"(?<![\d.])" + re.escape(core) + r"(?![\d.])", normalized):
+                matches.append((len(core), product_ids))
+        if not matches:
+            return None
+        product_ids = max(matches, key=lambda match: match[0])[1]
+        labels = "\n".join(f"- {self._label(pid)}" for pid in sorted(product_ids))
+        return f"สินค้าที่มี {key.replace('_', ' ')} = {self.specs[next(iter(product_ids))][key]}:\n{labels}"
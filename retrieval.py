@@ -0,0 +1,130 @@
+"""Hybrid lexical + vector retrieval over the indexed datasheet chunks.
+
+BM25Index is an in-memory inverted index over the chunk texts recorded in the
+index manifest, so exact part numbers ("952090", "900 451"), datasheet symbols
+and Thai spec terms are found without an embedding call; the English-only
+embedding model is weak on all three. Ranked lists from both retrievers are
+merged with reciprocal-rank fusion, and pack_context fills the LLM context
+with the best chunks up to a token budget, dropping lines already included by
+an overlapping chunk.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence
+
+from chunking import chunk_header, count_tokens
+from products import PART_NO_PATTERN, SPEC_ALIASES, normalize
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+|[\u0e00-\u0e7f]+")
+STOP_WORDS = {"a", "an", "and", "the", "of", "for", "to", "in", "is", "what", "with", "acc"}
+
+
+# Thai spec terms rarely occur in the (English) datasheets, so queries also search for their English equivalent
+_THAI_EXPANSIONS = [
+    (normalize(alias), expansion) for alias, expansion in SPEC_ALIASES.items() if "\u0e00" <= alias[0] <= "\u0e7f"
+]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case words and numbers, joined part numbers, and character bigrams for Thai (which has no spaces)."""
+    text = normalize(text)
+    tokens = ["".join(match.groups()) for match in PART_NO_PATTERN.finditer(text)]
+    for word in WORD_PATTERN.findall(text):
+        if "\u0e00" <= word[0] <= "\u0e7f":
+            tokens.extend(word[i:i + 2] for i in range(max(len(word) - 1, 1)))
+        elif word not in STOP_WORDS:
+            tokens.append(word)
+    return tokens
+
+
+def tokenize_query(text: str) -> List[str]:
+    tokens = tokenize(text)
+    normalized = normalize(text)
+    for alias, expansion in _THAI_EXPANSIONS:
+        if alias in normalized:
+            tokens.extend(tokenize(expansion))
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, entries: Sequence[dict], k1: float = 1.5, b: float = 0.75):
+        """entries are {"id", "metadata"} dicts as stored in the vector store; metadata["text"] is indexed."""
+        self.k1 = k1
+        self.b = b
+        self.entries = [e for e in entries if e.get("metadata", {}).get("text")]
+        self.postings: Dict[str, List[tuple]] = defaultdict(list)
+        self.lengths: List[int] = []
+        for row, entry in enumerate(self.entries):
+            counts = Counter(tokenize(entry["metadata"]["text"]))
+            self.lengths.append(sum(counts.values()))
+            for token, tf in counts.items():
+                self.postings[token].append((row, tf))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        n = len(self.entries)
+        self.idf = {token: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for token, p in self.postings.items()}
+
+    @classmethod
+    def from_manifest(cls, manifest: dict) -> "BM25Index":
+        return cls([v for doc in manifest.get("documents", {}).values() for v in doc.get("vectors", [])])
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def query(self, text: str, top_k: int) -> List[dict]:
+        """Returns matches as {"id", "score", "metadata"} dicts, best first, like VectorStore.query."""
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(tokenize_query(text)):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for row, tf in self.postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[row] / self.avg_length)
+                scores[row] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [{"id": self.entries[row]["id"], "score": score, "metadata": self.entries[row]["metadata"]} for row, score in best]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[dict]], k: int = 60) -> List[dict]:
+    """Merges ranked match lists; a chunk scores sum(1 / (k + rank)) over the lists it appears in."""
+    fused: Dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            entry = fused.setdefault(match["id"], {"id": match["id"], "score": 0.0, "metadata": match["metadata"]})
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda m: m["score"], reverse=True)
+
+
+def pack_context(matches: Sequence[dict], max_tokens: int) -> str:
+    """Joins the chunk texts of matches, best first, within max_tokens.
+
+    Lines already taken from a higher-ranked chunk (overlap between neighbouring
+    chunks, repeated page furniture) are dropped; a chunk with nothing new is
+    skipped, and one that no longer fits is skipped in favour of smaller ones.
+    """
+    seen, blocks, used = set(), [], 0
+    for match in matches:
+        metadata = match["metadata"]
+        lines = metadata.get("text", "").split("\n")
+        header = chunk_header(metadata["product_id"]) if metadata.get("product_id") else None
+        if header and lines[0] == header:
+            lines = lines[1:]
+        fresh = [line for line in lines if line.strip() and line not in seen]
+        if not fresh:
+            continue
+        block = "\n".join([header] + fresh if header else fresh)
+        tokens = count_tokens(block)
+        if used + tokens > max_tokens:
+            if blocks:
+                continue
+            # Always return something: cut the best chunk down to the budget
+            while fresh and count_tokens(block) > max_tokens:
+                fresh.pop()
+                block = "\n".join([header] + fresh if header else fresh)
+            if not fresh:
+                continue
+            tokens = count_tokens(block)
+        seen.update(fresh)
+        blocks.append(block)
+        used += tokens
+    return "\n\n".join(blocks)
@@ -0,0 +1,174 @@
+"""Vector stores behind a common interface used by PDFProcessor.
+
+PineconeVectorStore wraps a Pinecone index namespace. LocalVectorStore keeps
+every embedding in one contiguous float32 matrix saved as .npy and
+memory-mapped on load, so gunicorn workers on the same host share it through
+the page cache and a query is a single matrix-vector product.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class VectorStore:
+    name = ""
+    # True when the backing index did not exist before this process attached to it
+    created = False
+
+    def upsert(self, vectors: List[dict]):
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]):
+        raise NotImplementedError
+
+    def clear(self):
+        """Deletes every vector, including ones this app no longer knows the ids of."""
+        raise NotImplementedError
+
+    def query(self, vector: List[float], top_k: int) -> List[dict]:
+        """Returns matches as {"id", "score", "metadata"} dicts, best first."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Persists pending writes. No-op for remote stores."""
+
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, index, name: str, namespace: str, created: bool = False):
+        self.index = index
+        self.name = name
+        self.namespace = namespace
+        self.created = created
+
+    def upsert(self, vectors: List[dict]):
+        self.index.upsert(vectors=vectors, namespace=self.namespace)
+
+    def delete(self, ids: List[str]):
+        self.index.delete(ids=ids, namespace=self.namespace)
+
+    def clear(self):
+        try:
+            self.index.delete(delete_all=True, namespace=self.namespace)
+        except Exception as e:
+            # Serverless indexes answer 404 for a namespace that holds no vectors yet
+            if 404 not in (getattr(e, 'status', None), getattr(e, 'status_code', None)):
+                raise
+
+    def query(self, vector: List[float], top_k: int) -> List[dict]:
+        results = self.index.query(vector=vector, top_k=top_k, include_metadata=True, namespace=self.namespace)
+        return [
+            {"id": m['id'], "score": m['score'], "metadata": m['metadata']}
+            for m in results.get('matches', []) if 'metadata' in m
+        ]
+
+
+class LocalVectorStore(VectorStore):
+    name = "local"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.matrix_path = os.path.join(directory, "vectors.npy")
+        self.meta_path = os.path.join(directory, "vectors.json")
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._metadata: List[dict] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        # Writes go to a dict and the matrix is rebuilt once, on flush or on the next query
+        self._pending: Optional[Dict[str, Tuple[np.ndarray, dict]]] = None
+        self.created = not os.path.exists(self.matrix_path)
+        if not self.created:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            matrix = np.load(self.matrix_path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load local vector index from {self.directory}: {e}")
+            self.created = True
+            return
+        if matrix.shape[0] != len(meta["ids"]):
+            logger.error(f"Local vector index is inconsistent: {matrix.shape[0]} vectors, {len(meta['ids'])} ids")
+            self.created = True
+            return
+        self._ids, self._metadata, self._matrix = meta["ids"], meta["metadata"], matrix
+        logger.info(f"Local vector index loaded: {len(self._ids)} vectors from {self.directory}")
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _entries(self) -> Dict[str, Tuple[np.ndarray, dict]]:
+        if self._pending is None:
+            self._pending = {i: (self._matrix[row], self._metadata[row]) for row, i in enumerate(self._ids)}
+        return self._pending
+
+    def _rebuild(self):
+        entries = self._pending
+        self._ids = list(entries)
+        self._metadata = [entries[i][1] for i in self._ids]
+        if entries:
+            self._matrix = np.ascontiguousarray(np.stack([entries[i][0] for i in self._ids]), dtype=np.float32)
+        else:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._pending = None
+
+    def upsert(self, vectors: List[dict]):
+        with self._lock:
+            entries = self._entries()
+            for v in vectors:
+                values = np.asarray(v["values"], dtype=np.float32)
+                norm = np.linalg.norm(values)
+                # Stored unit-length so a dot product is the cosine similarity
+                entries[v["id"]] = (values / norm if norm else values, v.get("metadata", {}))
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            entries = self._entries()
+            for i in ids:
+                entries.pop(i, None)
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+
+    def query(self, vector: List[float], top_k: int) -> List[dict]:
+        with self._lock:
+            if self._pending is not None:
+                self._rebuild()
+            ids, metadata, matrix = self._ids, self._metadata, self._matrix
+        if not ids or top_k <= 0:
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if not norm:
+            return []
+        scores = matrix @ (q / norm)
+        k = min(top_k, len(ids))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [{"id": ids[row], "score": float(scores[row]), "metadata": metadata[row]} for row in best]
+
+    def flush(self):
+        with self._lock:
+            if self._pending is None:
+                return
+            self._rebuild()
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_suffix = f".{os.getpid()}.tmp"
+            # np.save appends .npy unless the name already ends with it
+            tmp_matrix = self.matrix_path + tmp_suffix + ".npy"
+            np.save(tmp_matrix, self._matrix)
+            with open(self.meta_path + tmp_suffix, "w", encoding="utf-8") as f:
+                json.dump({"ids": self._ids, "metadata": self._metadata}, f, ensure_ascii=False)
+            os.replace(tmp_matrix, self.matrix_path)
+            os.replace(self.meta_path + tmp_suffix, self.meta_path)
+            self.created = False
+        logger.info(f"Local vector index saved: {len(self._ids)} vectors to {self.directory}")
+        self._load()